@@ -1,49 +1,657 @@
 import genanki
-import random
+import hashlib
+import html
+import itertools
+import json
 import os
-from anki_template import get_anki_model
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from genanki.apkg_col import APKG_COL
+from genanki.apkg_schema import APKG_SCHEMA
+from anki_template import DEFAULT_THEME, get_anki_model, get_lean_anki_model, stable_id
+from math_prerender import restore_latex
+from qa_extractor import minify_html
 
-def create_anki_deck(qa_dict, deck_name="Flashcard Domande e Risposte", theme=None, qa_dict_per_file=None):
-    """Crea un mazzo Anki dalle domande e risposte."""
+try:
+    import zstandard
+except ImportError:  # zstandard non installato: disponibile solo il formato anki2
+    zstandard = None
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_WHITESPACE_RE = re.compile(r'\s+')
+# Come strip_html_preserving_media_filenames di Anki
+_HTML_COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+_HTML_BLOCK_RE = re.compile(r'<(style|script).*?>.*?</\1>', re.DOTALL | re.IGNORECASE)
+_HTML_IMG_RE = re.compile(r'<img[^>]+src=["\']?([^"\'>]+)["\']?[^>]*>', re.IGNORECASE)
+
+# Stima prudente della dimensione di un .apkg: parte fissa (schema, modello,
+# mazzi) più, per ogni nota, i byte dei campi e l'overhead di righe e indici
+_PACKAGE_BASE_BYTES = 64 * 1024
+_NOTE_BASE_BYTES = 200
+
+# Lo schema della collezione senza indici: BulkPackage li crea dopo l'inserimento
+_SCHEMA_STATEMENTS = [statement.strip() for statement in APKG_SCHEMA.split(';') if statement.strip()]
+_SCHEMA_TABLES = ';\n'.join(s for s in _SCHEMA_STATEMENTS if not s.upper().startswith('CREATE INDEX')) + ';'
+_SCHEMA_INDEXES = [s for s in _SCHEMA_STATEMENTS if s.upper().startswith('CREATE INDEX')]
+
+# Versione del formato del manifest di build
+MANIFEST_FORMAT = 1
+
+# Formati del pacchetto: "anki2" (legacy, default, leggibile da ogni client)
+# e "anki21b" (Anki 2.1.50+: collezione e media compressi con zstd)
+PACKAGE_FORMATS = ('anki2', 'anki21b')
+# PackageMetadata (protobuf di Anki) con version = VERSION_LATEST
+_ANKI21B_META = b'\x08\x03'
+
+def question_key(domanda):
+    """Normalizza una domanda (HTML renderizzato) in una chiave stabile.
+    
+    Tag HTML, entità, maiuscole e spazi non contano: correggere la
+    formattazione di una domanda non ne cambia l'identità. Le formule
+    pre-renderizzate contano come il loro LaTeX.
+    """
+    text = html.unescape(_TAG_RE.sub(' ', restore_latex(domanda)))
+    return _WHITESPACE_RE.sub(' ', text).strip().casefold()
+
+def deck_id_for(deck_path):
+    """Restituisce l'ID deterministico di un mazzo dal suo nome completo (es. "Corso::capitolo")."""
+    return stable_id('deck', deck_path)
+
+def _deck_fields(qa_dict, deck_name, qa_dict_per_file, cards=None):
+    """Colonne (nome_mazzo, domande, risposte) dei mazzi da esportare, nell'ordine dei file.
+
+    Con cards (card_store.CardStore) o qa_dict_per_file c'è un sottomazzo per
+    ogni file, altrimenti un solo mazzo con qa_dict.
+    """
+    if cards is not None:
+        return [
+            (f"{deck_name}::{os.path.splitext(file_name)[0]}",
+             [card.question for card in file_cards], [card.answer for card in file_cards])
+            for file_name, file_cards in cards.iter_files()
+        ]
+    if qa_dict_per_file:
+        return [
+            (f"{deck_name}::{os.path.splitext(file_name)[0]}", list(file_qa_dict), list(file_qa_dict.values()))
+            for file_name, file_qa_dict in qa_dict_per_file.items()
+        ]
+    return [(deck_name, list(qa_dict), list(qa_dict.values()))]
+
+def _unique_guid(guid, deck_path, key, used_guids):
+    """Rende unico il GUID di una nota e lo registra in used_guids.
+
+    Il GUID di base deriva dalla domanda normalizzata (genanki.guid_for(key));
+    se è già usato, ad esempio dalla stessa domanda in un altro sottomazzo,
+    si include il nome del mazzo e poi, finché serve, un contatore. I GUID
+    delle note senza collisioni restano quelli di sempre.
+    """
+    if guid in used_guids:
+        guid = genanki.guid_for(deck_path, key)
+        counter = 1
+        while guid in used_guids:
+            guid = genanki.guid_for(deck_path, key, counter)
+            counter += 1
+    used_guids.add(guid)
+    return guid
+
+def _iter_deck_notes(qa_dict, deck_name, qa_dict_per_file, cards=None):
+    """Produce (nome_mazzo, guid, domanda, risposta) per ogni nota del mazzo.
+    
+    Il GUID deriva dalla domanda normalizzata ed è reso unico da _unique_guid.
+    """
+    used_guids = set()
+    for deck_path, domande, risposte in _deck_fields(qa_dict, deck_name, qa_dict_per_file, cards):
+        for domanda, risposta in zip(domande, risposte):
+            key = question_key(domanda)
+            guid = _unique_guid(genanki.guid_for(key), deck_path, key, used_guids)
+            yield deck_path, guid, domanda, risposta
+
+def _note_hash(deck_path, domanda, risposta):
+    digest = hashlib.blake2b(digest_size=16)
+    for value in (deck_path, domanda, risposta):
+        digest.update(value.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def build_manifest(qa_dict, deck_name="Flashcard Domande e Risposte", theme=None, qa_dict_per_file=None,
+                   mathjax=True, lean=False, cards=None):
+    """Calcola il manifest di una build: per ogni nota (GUID) l'hash del contenuto.
+    
+    Il manifest va salvato accanto a ogni build completa e passato come
+    previous_manifest a create_anki_deck per produrre un pacchetto delta.
+    Gli argomenti sono gli stessi di create_anki_deck.
+    
+    Returns:
+        Dizionario serializzabile in JSON con model_id e note
+        (guid -> {"hash", "deck", "question"})
+    """
+    if theme is None:
+        theme = dict(DEFAULT_THEME)
+    notes = {
+        guid: {'hash': _note_hash(deck_path, domanda, risposta), 'deck': deck_path, 'question': question_key(domanda)}
+        for deck_path, guid, domanda, risposta in _iter_deck_notes(qa_dict, deck_name, qa_dict_per_file, cards)
+    }
+    return {
+        'format': MANIFEST_FORMAT,
+        'deck_name': deck_name,
+        'model_id': _get_model(theme, mathjax, lean).model_id,
+        'notes': notes,
+    }
+
+def removed_notes(previous_manifest, manifest):
+    """Restituisce le note del manifest precedente che non esistono più, come lista di dizionari."""
+    return [
+        dict(entry, guid=guid)
+        for guid, entry in previous_manifest['notes'].items()
+        if guid not in manifest['notes']
+    ]
+
+def sort_field_text(field):
+    """Testo del campo di ordinamento come lo salva Anki: HTML rimosso, nomi dei media conservati."""
+    if '<' not in field and '&' not in field:
+        return field
+    text = _HTML_IMG_RE.sub(r' \1 ', _HTML_BLOCK_RE.sub('', _HTML_COMMENT_RE.sub('', field)))
+    return html.unescape(_TAG_RE.sub('', text)).replace('\xa0', ' ')
+
+def field_checksum(text):
+    """Checksum del campo di ordinamento usato da Anki per i duplicati (primi 32 bit dello SHA-1)."""
+    return int(hashlib.sha1(text.encode('utf-8')).hexdigest()[:8], 16)
+
+class BulkPackage:
+    """Pacchetto Anki con le note memorizzate per colonne invece che come genanki.Note.
+    
+    Espone la parte di interfaccia di genanki.Package usata dall'app
+    (write_to_db, write_to_file, decks, media_files) e scrive la stessa
+    collezione, ma calcola campi di ordinamento e checksum in blocco e
+    inserisce note e card con executemany in un'unica transazione.
+    A differenza di genanki, sfld e csum sono valorizzati come li
+    calcolerebbe Anki invece di contenere l'HTML grezzo e 0.
+    
+    Args:
+        model: genanki.Model delle note
+        decks: Lista di genanki.Deck (senza note) da creare nella collezione
+        deck_ids: Colonna con l'ID del mazzo di ogni nota
+        guids: Colonna con il GUID di ogni nota
+        field_columns: Una colonna per ogni campo del modello, nello stesso ordine
+        sort_fields: Colonna opzionale dei campi di ordinamento già calcolati
+            con sort_field_text (es. dai worker di create_anki_deck)
+        checksums: Colonna opzionale dei relativi field_checksum
+    
+    Le note vanno fornite raggruppate per mazzo, nell'ordine di decks, così
+    gli ID generati coincidono con quelli che assegnerebbe genanki.
+    """
+    
+    def __init__(self, model, decks, deck_ids, guids, field_columns, sort_fields=None, checksums=None):
+        if len(field_columns) != len(model.fields):
+            raise ValueError(f"Il modello ha {len(model.fields)} campi, ricevute {len(field_columns)} colonne")
+        self.model = model
+        self.decks = decks
+        self.deck_ids = deck_ids
+        self.guids = guids
+        self.field_columns = field_columns
+        self.sort_fields = sort_fields
+        self.checksums = checksums
+        self.media_files = []
+    
+    def __len__(self):
+        return len(self.guids)
+    
+    def write_to_db(self, cursor, timestamp, id_gen):
+        cursor.executescript(_SCHEMA_TABLES)
+        cursor.executescript(APKG_COL)
+        model = self.model
+        mod = int(timestamp)
+        
+        decks_json, models_json = cursor.execute('SELECT decks, models FROM col').fetchone()
+        decks_json = json.loads(decks_json)
+        decks_json.update({str(deck.deck_id): deck.to_json() for deck in self.decks})
+        models_json = json.loads(models_json)
+        if self.deck_ids:
+            # Come genanki, il modello punta all'ultimo mazzo che contiene note
+            models_json[str(model.model_id)] = model.to_json(timestamp, self.deck_ids[-1])
+        cursor.execute('UPDATE col SET decks = ?, models = ?', (json.dumps(decks_json), json.dumps(models_json)))
+        
+        # Campi derivati calcolati per colonna
+        sort_fields = self.sort_fields
+        if sort_fields is None:
+            sort_fields = [sort_field_text(field) for field in self.field_columns[model.sort_field_index]]
+        checksums = self.checksums
+        if checksums is None:
+            checksums = [field_checksum(text) for text in sort_fields]
+        joined_fields = ['\x1f'.join(fields) for fields in zip(*self.field_columns)]
+        requirements = [
+            (card_ord, any if any_or_all == 'any' else all, required_ords)
+            for card_ord, any_or_all, required_ords in model._req
+        ]
+        
+        note_rows = []
+        card_rows = []
+        for deck_id, guid, flds, sfld, csum, fields in zip(
+                self.deck_ids, self.guids, joined_fields, sort_fields, checksums, zip(*self.field_columns)):
+            # Stesso ordine di genanki: ID della nota, poi quelli delle sue card
+            note_id = next(id_gen)
+            note_rows.append((note_id, guid, model.model_id, mod, -1, '  ', flds, sfld, csum, 0, ''))
+            for card_ord, op, required_ords in requirements:
+                if op(fields[ord_] for ord_ in required_ords):
+                    card_rows.append((next(id_gen), note_id, deck_id, card_ord, mod, -1,
+                                      0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, ''))
+        
+        cursor.executemany('INSERT INTO notes VALUES(?,?,?,?,?,?,?,?,?,?,?)', note_rows)
+        cursor.executemany('INSERT INTO cards VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', card_rows)
+        # Costruire gli indici a tabelle piene costa meno che aggiornarli riga per riga
+        for statement in _SCHEMA_INDEXES:
+            cursor.execute(statement)
+    
+    def write_to_file(self, file, timestamp=None, package_format='anki2', zstd_level=3):
+        with open(file, 'wb') as f:
+            write_package_to_stream(self, f, timestamp=timestamp, package_format=package_format, zstd_level=zstd_level)
+
+def _subdeck_columns(item):
+    """Calcola le colonne di un sottomazzo; nei build paralleli gira in un worker.
+    
+    Args:
+        item: Tupla (nome_mazzo, domande, risposte, lean) come da _deck_fields
+    
+    Returns:
+        Tupla (nome_mazzo, chiavi, guid, hash, colonne_campi,
+        campi_ordinamento, checksum). I GUID non tengono ancora conto dei
+        duplicati tra sottomazzi, risolti nell'unione (vedi _iter_deck_notes)
+    """
+    deck_path, domande, risposte, lean = item
+    keys = [question_key(domanda) for domanda in domande]
+    # Chiavi e hash dipendono dal testo renderizzato, non dal modello
+    hashes = [_note_hash(deck_path, domanda, risposta) for domanda, risposta in zip(domande, risposte)]
+    if lean:
+        # Campo Math: MathJax viene caricato solo dove servono formule
+        math_flags = [
+            '1' if '\\\\(' in domanda or '\\\\(' in risposta else ''
+            for domanda, risposta in zip(domande, risposte)
+        ]
+        domande = [minify_html(domanda) for domanda in domande]
+        risposte = [minify_html(risposta) for risposta in risposte]
+        field_columns = [domande, risposte, math_flags]
+    else:
+        field_columns = [domande, risposte]
+    # Il campo di ordinamento del modello è la domanda
+    sort_fields = [sort_field_text(domanda) for domanda in domande]
+    return (
+        deck_path,
+        keys,
+        [genanki.guid_for(key) for key in keys],
+        hashes,
+        field_columns,
+        sort_fields,
+        [field_checksum(text) for text in sort_fields],
+    )
+
+def _get_model(theme, mathjax, lean):
+    if lean:
+        return get_lean_anki_model(theme=theme, mathjax=mathjax)
+    return get_anki_model(theme=theme, mathjax=mathjax)
+
+def create_anki_deck(qa_dict, deck_name="Flashcard Domande e Risposte", theme=None, qa_dict_per_file=None,
+                     previous_manifest=None, jobs=1, media_files=None, mathjax=True, lean=False, cards=None):
+    """Crea un mazzo Anki dalle domande e risposte.
+    
+    Gli ID di modello, mazzi e note sono deterministici: riesportando lo
+    stesso contenuto Anki aggiorna le note esistenti invece di duplicarle.
+    
+    Se previous_manifest (vedi build_manifest) è fornito, il pacchetto è un
+    delta: contiene solo le note nuove o modificate rispetto a quella build.
+    Le note rimosse si ottengono con removed_notes.
+    
+    Con jobs > 1 (o None, tutti i core) i sottomazzi vengono preparati in
+    parallelo da un pool di processi e poi uniti nell'ordine dei file: il
+    pacchetto è identico a quello sequenziale.
+    
+    media_files è la lista dei file media (es. prodotta da
+    media_pipeline.MediaCollector.write) da includere: in un pacchetto delta
+    restano solo quelli usati dalle note esportate.
+    
+    mathjax=False crea un modello senza lo script di MathJax, da usare quando
+    tutte le formule sono state pre-renderizzate (vedi math_prerender).
+    
+    lean=True usa il modello leggero (anki_template.get_lean_anki_model):
+    tema nel CSS, HTML dei campi minificato e campo Math valorizzato solo
+    nelle note con formule, così MathJax viene caricato solo lì.
+    
+    cards (card_store.CardStore) sostituisce qa_dict e qa_dict_per_file:
+    ogni file dell'archivio diventa un sottomazzo, con le card nell'ordine
+    dell'archivio.
+    
+    Returns:
+        BulkPackage con le note per colonne; len(pacchetto) è il numero di note
+    """
     if theme is None:
-        theme = {
-            "question_bg": "#ffffff",
-            "question_fg": "#2c3e50",
-            "answer_bg": "#f8f9fa",
-            "answer_fg": "#2c3e50",
-            "font_family": "Arial, sans-serif",
-            "question_font_size": "16px",
-            "answer_font_size": "14px",
-            "border_radius": "8px",
-            "box_shadow": "0 1px 3px rgba(0,0,0,0.1)"
-        }
-    
-    # Generiamo un model_id casuale da passare a get_anki_model
-    model_id = random.randrange(1 << 30, 1 << 31)
-    my_model = get_anki_model(theme=theme, model_id=model_id)
+        theme = dict(DEFAULT_THEME)
+    
+    # L'ID del modello viene derivato dal tema e dai template
+    my_model = _get_model(theme, mathjax, lean)
+    
+    # Con un modello diverso (es. tema cambiato) tutte le note vanno riesportate
+    previous_notes = {}
+    if previous_manifest is not None and previous_manifest.get('model_id') == my_model.model_id:
+        previous_notes = previous_manifest['notes']
     
     # Creiamo il mazzo principale
-    main_deck_id = random.randrange(1 << 30, 1 << 31)
-    main_deck = genanki.Deck(main_deck_id, deck_name)
+    main_deck = genanki.Deck(deck_id_for(deck_name), deck_name)
     
-    # Lista per raccogliere tutti i mazzi
-    all_decks = [main_deck]
+    # Lista per raccogliere tutti i mazzi; con i file c'è un sottomazzo per ognuno
+    decks = {deck_name: main_deck}
+    items = []
+    for deck_path, domande, risposte in _deck_fields(qa_dict, deck_name, qa_dict_per_file, cards):
+        if deck_path not in decks:
+            decks[deck_path] = genanki.Deck(deck_id_for(deck_path), deck_path)
+        items.append((deck_path, domande, risposte, lean))
     
-    # Se abbiamo qa_dict_per_file, creiamo sottomazzi per ogni file
-    if qa_dict_per_file:
-        for file_name, file_qa_dict in qa_dict_per_file.items():
-            subdeck_name = os.path.splitext(file_name)[0]
-            subdeck_id = random.randrange(1 << 30, 1 << 31)
-            subdeck = genanki.Deck(subdeck_id, f"{deck_name}::{subdeck_name}")
-            all_decks.append(subdeck)
-            
-            for domanda, risposta in file_qa_dict.items():
-                note = genanki.Note(model=my_model, fields=[domanda, risposta])
-                subdeck.add_note(note)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(items))
+    if jobs <= 1:
+        parts = [_subdeck_columns(item) for item in items]
     else:
-        for domanda, risposta in qa_dict.items():
-            note = genanki.Note(model=my_model, fields=[domanda, risposta])
-            main_deck.add_note(note)
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            parts = list(pool.map(_subdeck_columns, items, chunksize=max(1, len(items) // (jobs * 4))))
+    
+    # Unione delle colonne nell'ordine dei sottomazzi
+    deck_ids = []
+    guids = []
+    field_columns = [[] for _ in my_model.fields]
+    sort_fields = []
+    checksums = []
+    used_guids = set()
+    for deck_path, keys, part_guids, hashes, part_columns, part_sort_fields, part_checksums in parts:
+        deck_id = decks[deck_path].deck_id
+        for i, guid in enumerate(part_guids):
+            guid = _unique_guid(guid, deck_path, keys[i], used_guids)
+            previous = previous_notes.get(guid)
+            if previous is not None and previous['hash'] == hashes[i]:
+                continue
+            deck_ids.append(deck_id)
+            guids.append(guid)
+            for column, part_column in zip(field_columns, part_columns):
+                column.append(part_column[i])
+            sort_fields.append(part_sort_fields[i])
+            checksums.append(part_checksums[i])
+    
+    package = BulkPackage(my_model, list(decks.values()), deck_ids, guids, field_columns,
+                          sort_fields=sort_fields, checksums=checksums)
+    package.media_files = _referenced_media(media_files, package.field_columns)
+    return package
+
+def _estimated_note_bytes(package):
+    """Stima per ogni nota i byte che occupa nella collezione."""
+    sort_fields = package.sort_fields
+    if sort_fields is None:
+        sort_fields = [sort_field_text(field) for field in package.field_columns[package.model.sort_field_index]]
+    sizes = [
+        int(1.1 * (sum(len(field.encode('utf-8')) for field in fields) + len(sfld.encode('utf-8')))) + _NOTE_BASE_BYTES
+        for fields, sfld in zip(zip(*package.field_columns), sort_fields)
+    ]
+    # Ogni media pesa sulla prima nota che lo usa
+    media_sizes = {os.path.basename(path): os.path.getsize(path) for path in package.media_files}
+    if media_sizes:
+        for i, fields in enumerate(zip(*package.field_columns)):
+            for field in fields:
+                for name in _HTML_IMG_RE.findall(field):
+                    sizes[i] += media_sizes.pop(name, 0)
+    return sizes
+
+def _referenced_media(media_files, field_columns):
+    """Filtra i media usati da almeno un campo delle note."""
+    if not media_files:
+        return []
+    referenced = {name for column in field_columns for field in column for name in _HTML_IMG_RE.findall(field)}
+    return [path for path in media_files if os.path.basename(path) in referenced]
+
+def _slice_package(package, start, end):
+    """Restituisce un BulkPackage con le note [start, end) del pacchetto."""
+    deck_ids = package.deck_ids[start:end]
+    used_decks = set(deck_ids)
+    # Il mazzo principale resta in ogni pacchetto, così la gerarchia è sempre la stessa
+    decks = [deck for i, deck in enumerate(package.decks) if i == 0 or deck.deck_id in used_decks]
+    shard = BulkPackage(
+        package.model,
+        decks,
+        deck_ids,
+        package.guids[start:end],
+        [column[start:end] for column in package.field_columns],
+        sort_fields=package.sort_fields[start:end] if package.sort_fields is not None else None,
+        checksums=package.checksums[start:end] if package.checksums is not None else None,
+    )
+    shard.media_files = _referenced_media(package.media_files, shard.field_columns)
+    return shard
+
+def shard_package(package, max_cards=None, max_bytes=None):
+    """Divide un pacchetto troppo grande in più pacchetti da importare separatamente.
+    
+    I tagli cadono tra un sottomazzo e l'altro; un sottomazzo che da solo
+    supera i limiti viene diviso in intervalli di card. Tutti i pacchetti
+    condividono modello, ID dei mazzi e GUID delle note, quindi importarli in
+    qualunque ordine ricostruisce lo stesso mazzo. Ogni pacchetto contiene
+    solo i media usati dalle sue note.
+    
+    Args:
+        package: BulkPackage restituito da create_anki_deck
+        max_cards: Numero massimo di note per pacchetto (None: nessun limite)
+        max_bytes: Dimensione massima del .apkg in byte, stimata per eccesso
+            (None: nessun limite)
+    
+    Returns:
+        Lista di BulkPackage; contiene solo package se rientra già nei limiti
+    """
+    if max_cards is not None and max_cards < 1:
+        raise ValueError("max_cards deve essere almeno 1")
+    budget = None
+    if max_bytes is not None:
+        budget = max_bytes - _PACKAGE_BASE_BYTES
+        if budget <= 0:
+            raise ValueError(f"max_bytes deve superare {_PACKAGE_BASE_BYTES} byte")
+    
+    sizes = _estimated_note_bytes(package) if budget is not None else [0] * len(package)
+    
+    def fits(count, size):
+        return (max_cards is None or count <= max_cards) and (budget is None or size <= budget)
+    
+    if fits(len(package), sum(sizes)):
+        return [package]
+    
+    # Le note di un sottomazzo sono contigue: ogni sottomazzo è un intervallo
+    runs = []
+    run_start = 0
+    for i in range(1, len(package) + 1):
+        if i == len(package) or package.deck_ids[i] != package.deck_ids[run_start]:
+            runs.append((run_start, i))
+            run_start = i
     
-    my_package = genanki.Package(all_decks)
-    return my_package
\ No newline at end of file
+    ranges = []
+    shard_start = shard_end = shard_size = 0
+    for start, end in runs:
+        run_size = sum(sizes[start:end])
+        if fits(end - shard_start, shard_size + run_size):
+            shard_end = end
+            shard_size += run_size
+            continue
+        if shard_end > shard_start:
+            ranges.append((shard_start, shard_end))
+        shard_start = shard_end = start
+        shard_size = 0
+        if fits(end - start, run_size):
+            shard_end = end
+            shard_size = run_size
+            continue
+        # Sottomazzo troppo grande da solo: si divide per intervalli di card
+        for i in range(start, end):
+            if shard_end > shard_start and not fits(i + 1 - shard_start, shard_size + sizes[i]):
+                ranges.append((shard_start, shard_end))
+                shard_start = i
+                shard_size = 0
+            shard_end = i + 1
+            shard_size += sizes[i]
+    if shard_end > shard_start:
+        ranges.append((shard_start, shard_end))
+    
+    return [_slice_package(package, start, end) for start, end in ranges]
+
+def shard_file_names(file_name, count):
+    """Nomi dei file dei pacchetti: corso.apkg diventa corso.1.apkg, corso.2.apkg, ...
+    
+    Con un solo pacchetto il nome resta invariato.
+    """
+    if count == 1:
+        return [file_name]
+    root, ext = os.path.splitext(file_name)
+    width = len(str(count))
+    return [f"{root}.{i:0{width}d}{ext}" for i in range(1, count + 1)]
+
+def shard_index(shards, file_names):
+    """Indice dei pacchetti prodotti da shard_package, serializzabile in JSON.
+    
+    Returns:
+        Dizionario con mazzo, modello, numero totale di note e, per ogni
+        pacchetto, file, numero di note e mazzi contenuti
+    """
+    entries = []
+    for shard, file_name in zip(shards, file_names):
+        used_decks = set(shard.deck_ids)
+        entries.append({
+            'file': os.path.basename(file_name),
+            'cards': len(shard),
+            'decks': [deck.name for deck in shard.decks if deck.deck_id in used_decks],
+        })
+    return {
+        'format': MANIFEST_FORMAT,
+        'deck_name': shards[0].decks[0].name,
+        'model_id': shards[0].model.model_id,
+        'cards': sum(len(shard) for shard in shards),
+        'shards': entries,
+    }
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def _media_entry(name, size, sha1):
+    """Codifica un MediaEntry del protobuf di Anki (nome, dimensione, SHA-1)."""
+    name = name.encode('utf-8')
+    entry = b'\x0a' + _varint(len(name)) + name + b'\x10' + _varint(size) + b'\x1a' + _varint(len(sha1)) + sha1
+    # Campo "entries" di MediaEntries
+    return b'\x0a' + _varint(len(entry)) + entry
+
+def _empty_collection():
+    """Collezione legacy vuota, inclusa nei pacchetti anki21b per i client che non li supportano."""
+    conn = sqlite3.connect(':memory:')
+    try:
+        conn.executescript(APKG_SCHEMA)
+        conn.executescript(APKG_COL)
+        conn.commit()
+        return conn.serialize()
+    finally:
+        conn.close()
+
+def _write_anki21b(outzip, collection, db_path, media_paths, zstd_level):
+    """Scrive nel zip il layout anki21b: meta, collezione e media compressi con zstd.
+    
+    La collezione mantiene lo schema di genanki, che Anki aggiorna
+    all'importazione come per i pacchetti .anki21.
+    """
+    compressor = zstandard.ZstdCompressor(level=zstd_level)
+    outzip.writestr('meta', _ANKI21B_META)
+    with outzip.open('collection.anki21b', 'w') as member:
+        with compressor.stream_writer(member, closefd=False) as writer:
+            if collection is not None:
+                writer.write(collection)
+            else:
+                with open(db_path, 'rb') as f:
+                    shutil.copyfileobj(f, writer)
+    outzip.writestr('collection.anki2', _empty_collection())
+    
+    entries = []
+    for idx, path in enumerate(media_paths):
+        sha1 = hashlib.sha1()
+        size = 0
+        with open(path, 'rb') as f, outzip.open(str(idx), 'w') as member:
+            with compressor.stream_writer(member, closefd=False) as writer:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    sha1.update(chunk)
+                    size += len(chunk)
+                    writer.write(chunk)
+        entries.append(_media_entry(os.path.basename(path), size, sha1.digest()))
+    outzip.writestr('media', compressor.compress(b''.join(entries)))
+
+def write_package_to_stream(package, stream, in_memory=True, timestamp=None, compression=zipfile.ZIP_STORED,
+                            package_format='anki2', zstd_level=3):
+    """Scrive un pacchetto (BulkPackage o genanki.Package) come .apkg direttamente su uno stream scrivibile.
+    
+    A differenza di Package.write_to_file non serve un file .apkg temporaneo
+    da rileggere: il contenitore zip viene scritto sullo stream (anche non
+    posizionabile, es. la risposta di un server) man mano che viene prodotto.
+    
+    Args:
+        package: Pacchetto restituito da create_anki_deck
+        stream: Oggetto file binario aperto in scrittura (es. BytesIO)
+        in_memory: Se True il database della collezione resta in memoria
+            (richiede Python 3.11 per sqlite3.Connection.serialize); altrimenti
+            usa un file temporaneo su disco, eliminato al termine
+        timestamp: Istante di creazione della collezione (default: adesso)
+        compression: Metodo di compressione zip (default: come genanki)
+        package_format: "anki2" (legacy, default) oppure "anki21b", più
+            piccolo e veloce da importare ma leggibile solo da Anki 2.1.50+;
+            richiede il pacchetto zstandard
+        zstd_level: Livello di compressione zstd per il formato anki21b (1-22)
+    """
+    if package_format not in PACKAGE_FORMATS:
+        raise ValueError(f"Formato del pacchetto non valido: {package_format!r} (ammessi: {', '.join(PACKAGE_FORMATS)})")
+    if package_format == 'anki21b':
+        if zstandard is None:
+            raise ImportError("Il formato anki21b richiede il pacchetto zstandard (pip install zstandard)")
+        # Il contenuto è già compresso con zstd
+        compression = zipfile.ZIP_STORED
+    
+    if timestamp is None:
+        timestamp = time.time()
+    id_gen = itertools.count(int(timestamp * 1000))
+    in_memory = in_memory and hasattr(sqlite3.Connection, 'serialize')
+    
+    db_path = None
+    if in_memory:
+        conn = sqlite3.connect(':memory:')
+    else:
+        db_fd, db_path = tempfile.mkstemp(suffix='.anki2')
+        os.close(db_fd)
+        conn = sqlite3.connect(db_path)
+    
+    try:
+        package.write_to_db(conn.cursor(), timestamp, id_gen)
+        conn.commit()
+        collection = conn.serialize() if in_memory else None
+        conn.close()
+        
+        with zipfile.ZipFile(stream, 'w', compression=compression) as outzip:
+            if package_format == 'anki21b':
+                _write_anki21b(outzip, collection, db_path, package.media_files, zstd_level)
+                return
+            
+            if in_memory:
+                outzip.writestr('collection.anki2', collection)
+                del collection
+            else:
+                outzip.write(db_path, 'collection.anki2')
+            
+            media_paths = dict(enumerate(package.media_files))
+            media_json = {idx: os.path.basename(path) for idx, path in media_paths.items()}
+            outzip.writestr('media', json.dumps(media_json))
+            for idx, path in media_paths.items():
+                outzip.write(path, str(idx))
+    finally:
+        conn.close()
+        if db_path is not None and os.path.exists(db_path):
+            os.remove(db_path)
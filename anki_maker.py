@@ -0,0 +1,506 @@
+"""Interfaccia a riga di comando per creare mazzi Anki senza Streamlit.
+
+Esempi:
+    python anki_maker.py build notes/ -o corso.apkg --jobs 8 --theme theme.json
+    python anki_maker.py watch notes/ -o corso.apkg
+
+Ogni file markdown diventa un sottomazzo, come nell'app Streamlit; i file
+trovati dentro sottocartelle diventano sottomazzi annidati.
+"""
+import argparse
+import glob
+import json
+import os
+import pathlib
+import sys
+import time
+
+from anki_deck_creator import (
+    PACKAGE_FORMATS,
+    build_manifest,
+    create_anki_deck,
+    removed_notes,
+    shard_file_names,
+    shard_index,
+    shard_package,
+    write_package_to_stream,
+)
+from anki_template import DEFAULT_THEME
+from card_store import CardStore
+from dedup import dropped_cards, find_near_duplicates, merge_near_duplicates
+from media_pipeline import MediaCollector
+from qa_extractor import extract_cards
+
+
+class StageTimer:
+    """Misura la durata delle fasi della build e stampa un riepilogo."""
+
+    def __init__(self):
+        self.stages = []
+
+    def __call__(self, name):
+        return _Stage(self, name)
+
+    def summary(self):
+        total = sum(seconds for _, seconds in self.stages)
+        lines = [f"{'fase':<16} {'tempo (s)':>10}"]
+        lines += [f"{name:<16} {seconds:>10.3f}" for name, seconds in self.stages]
+        lines.append(f"{'totale':<16} {total:>10.3f}")
+        return '\n'.join(lines)
+
+
+class _Stage:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.stages.append((self.name, time.perf_counter() - self.start))
+        return False
+
+
+def _glob_root(pattern):
+    """Cartella iniziale di un glob: la parte del percorso senza caratteri speciali."""
+    root = pattern
+    while glob.has_magic(root):
+        root = os.path.dirname(root)
+    return root or '.'
+
+
+def find_markdown_files(inputs):
+    """Risolve cartelle, glob e file in una lista ordinata di tuple (nome_sottomazzo, percorso).
+
+    Il nome è il percorso relativo alla cartella di partenza, con "::" come
+    separatore, così le sottocartelle diventano sottomazzi annidati. La
+    cartella di partenza è quella indicata, la parte fissa del glob o quella
+    del file; con più input è la cartella comune a tutti, così file omonimi
+    in cartelle diverse restano distinti.
+
+    Raises:
+        ValueError: Se due file diversi avrebbero lo stesso nome di sottomazzo
+    """
+    roots = []
+    found = {}
+    for entry in inputs:
+        if os.path.isdir(entry):
+            roots.append(entry)
+            paths = glob.glob(os.path.join(glob.escape(entry), '**', '*.md'), recursive=True)
+        elif glob.has_magic(entry):
+            roots.append(_glob_root(entry))
+            paths = glob.glob(entry, recursive=True)
+        else:
+            roots.append(os.path.dirname(entry) or '.')
+            paths = [entry]
+        for path in sorted(paths):
+            if os.path.isfile(path):
+                found.setdefault(os.path.abspath(path), None)
+
+    if not found:
+        return []
+    base = os.path.commonpath([os.path.abspath(root) for root in roots])
+    names = {}
+    for path in found:
+        name = os.path.relpath(path, base).replace(os.sep, '::')
+        if name in names:
+            raise ValueError(f"Due file avrebbero lo stesso sottomazzo {name!r}: {names[name]} e {path}")
+        names[name] = path
+    return list(names.items())
+
+
+def load_theme(path):
+    """Carica un tema JSON completando le chiavi mancanti con il tema di default."""
+    theme = dict(DEFAULT_THEME)
+    if path:
+        with open(path, encoding='utf-8') as f:
+            theme.update(json.load(f))
+    return theme
+
+
+def open_cache(args):
+    """Apre la cache di rendering indicata da --cache, se presente."""
+    if not args.cache:
+        return None
+    from render_cache import RenderCache
+    return RenderCache(db_path=args.cache)
+
+
+def open_math_renderer(args):
+    """Crea il renderer delle formule se è richiesto --prerender-math."""
+    if not args.prerender_math:
+        return None
+    from math_prerender import MathPrerenderer
+    return MathPrerenderer()
+
+
+def prerender_math(cards, renderer):
+    """Pre-renderizza le formule delle card.
+
+    Returns:
+        Tupla (cards, mathjax) con mathjax True se qualche formula richiede
+        ancora MathJax nel template
+    """
+    if renderer is None:
+        return cards, True
+    rendered, pending = renderer.render_cards(cards)
+    if pending:
+        print("Alcune formule non sono convertibili: le card mantengono MathJax", file=sys.stderr)
+    return rendered, pending
+
+
+def deck_name_for(args):
+    return args.deck_name or os.path.splitext(os.path.basename(args.output))[0]
+
+
+def write_package(package, output, package_format='anki2', zstd_level=3):
+    """Scrive il pacchetto su un file temporaneo e lo sostituisce atomicamente all'output."""
+    temp_path = f"{output}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            write_package_to_stream(package, f, package_format=package_format, zstd_level=zstd_level)
+        os.replace(temp_path, output)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def collect_images(cards, base_dirs, args):
+    """Porta nelle card le immagini referenziate, salvandole in <output>.media.
+
+    Returns:
+        Tupla (cards, media_files) con i riferimenti riscritti
+    """
+    collector = MediaCollector(
+        base_dirs,
+        f"{args.output}.media",
+        jobs=args.jobs,
+        max_dimension=args.max_image_size,
+        quality=args.image_quality
+    )
+    cards = cards.map_fields(collector.rewrite)
+    media_files = collector.write()
+    for file_name, src in collector.missing:
+        print(f"Immagine non trovata: {src} (in {file_name})", file=sys.stderr)
+    return cards, media_files
+
+
+def handle_duplicates(cards, args):
+    """Cerca le domande quasi duplicate tra i file (--dedup) e, con merge, le unisce.
+
+    I gruppi trovati vengono elencati in <output>.duplicates.json, dove
+    "kept" indica la card che un merge terrebbe; con merge le card scartate
+    vengono stampate prima di toglierle dal mazzo.
+
+    Returns:
+        Le card da esportare: con merge resta una sola card per gruppo
+    """
+    if not args.dedup:
+        return cards
+    clusters = find_near_duplicates(cards, threshold=args.dedup_threshold)
+    write_json(
+        [[{'file': card.file, 'line': card.line, 'question': card.raw_question, 'kept': card is cluster[-1]}
+          for card in cluster]
+         for cluster in clusters],
+        f"{args.output}.duplicates.json"
+    )
+    extra = sum(len(cluster) - 1 for cluster in clusters)
+    if args.dedup == 'merge':
+        for card, kept in dropped_cards(clusters):
+            print(f"Scartata {card.file}:{card.line} {card.raw_question!r} "
+                  f"(resta {kept.file}:{kept.line})")
+        cards = merge_near_duplicates(cards, clusters)
+        print(f"Duplicati: {extra} card unite in {len(clusters)} gruppi (elenco in {args.output}.duplicates.json)")
+    else:
+        print(f"Duplicati: {len(clusters)} gruppi di domande quasi uguali, {extra} card in più "
+              f"(elenco in {args.output}.duplicates.json)")
+    return cards
+
+
+def write_packages(package, args):
+    """Scrive il pacchetto, diviso in più file se supera --max-cards o --max-size.
+
+    Con più pacchetti viene scritto anche l'indice <output>.shards.json. Dopo
+    averlo scritto vengono eliminati i pacchetti della build precedente che
+    non fanno più parte dell'output (es. corso.3.apkg quando i pacchetti
+    scendono a due), così un'importazione della cartella non ripesca card
+    vecchie.
+
+    Returns:
+        Lista dei file .apkg scritti
+    """
+    index_path = f"{args.output}.shards.json"
+    previous = previous_package_files(args.output, index_path)
+    max_bytes = int(args.max_size * 1024 * 1024) if args.max_size else None
+    shards = shard_package(package, max_cards=args.max_cards, max_bytes=max_bytes)
+    file_names = shard_file_names(args.output, len(shards))
+    for shard, file_name in zip(shards, file_names):
+        write_package(shard, file_name, package_format=args.format, zstd_level=args.zstd_level)
+    if len(shards) > 1:
+        write_json(shard_index(shards, file_names), index_path)
+    elif os.path.exists(index_path):
+        os.remove(index_path)
+    current = {os.path.abspath(file_name) for file_name in file_names}
+    for file_name in previous:
+        if os.path.abspath(file_name) not in current and os.path.exists(file_name):
+            os.remove(file_name)
+    return file_names
+
+
+def previous_package_files(output, index_path):
+    """Pacchetti scritti dalla build precedente: quelli dell'indice, oppure output stesso.
+
+    Returns:
+        Lista dei percorsi, anche di file che non esistono più
+    """
+    directory = os.path.dirname(output)
+    try:
+        with open(index_path, encoding='utf-8') as f:
+            # L'indice contiene solo nomi di file: niente percorsi fuori dalla cartella dell'output
+            shards = [os.path.join(directory, os.path.basename(entry['file'])) for entry in json.load(f)['shards']]
+    except (OSError, ValueError, KeyError, TypeError):
+        shards = []
+    return [output] + shards
+
+
+def write_json(data, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+
+
+def write_manifest(cards, deck_name, theme, output, mathjax=True, lean=False):
+    """Scrive accanto al pacchetto il manifest della build (<output>.manifest.json)."""
+    manifest = build_manifest(None, deck_name=deck_name, theme=theme, mathjax=mathjax, lean=lean, cards=cards)
+    write_json(manifest, f"{output}.manifest.json")
+    return manifest
+
+
+def build(args):
+    """Esegue il comando build e restituisce il codice di uscita."""
+    timer = StageTimer()
+
+    with timer('ricerca file'):
+        try:
+            files = find_markdown_files(args.inputs)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            return 1
+    if not files:
+        print("Nessun file markdown trovato", file=sys.stderr)
+        return 1
+
+    previous_manifest = None
+    if args.since:
+        with open(args.since, encoding='utf-8') as f:
+            previous_manifest = json.load(f)
+
+    theme = load_theme(args.theme)
+    # Un delta deve usare lo stesso nome di mazzo della build di riferimento
+    deck_name = args.deck_name or (previous_manifest or {}).get('deck_name') or deck_name_for(args)
+    cache = open_cache(args)
+
+    with timer('estrazione'):
+        cards = extract_cards(
+            [(name, pathlib.Path(path)) for name, path in files],
+            jobs=args.jobs,
+            cache=cache
+        )
+    if cache is not None:
+        cache.close()
+    if not len(cards):
+        print("Nessuna domanda e risposta trovata nei file", file=sys.stderr)
+        return 1
+
+    with timer('duplicati'):
+        cards = handle_duplicates(cards, args)
+
+    with timer('media'):
+        base_dirs = {name: os.path.dirname(path) for name, path in files}
+        cards, media_files = collect_images(cards, base_dirs, args)
+
+    with timer('formule'):
+        cards, mathjax = prerender_math(cards, open_math_renderer(args))
+
+    with timer('creazione mazzo'):
+        package = create_anki_deck(
+            None,
+            deck_name=deck_name,
+            theme=theme,
+            previous_manifest=previous_manifest,
+            jobs=args.jobs,
+            media_files=media_files,
+            mathjax=mathjax,
+            lean=args.lean,
+            cards=cards
+        )
+
+    with timer('scrittura'):
+        written = write_packages(package, args)
+        manifest = write_manifest(cards, deck_name, theme, args.output, mathjax=mathjax, lean=args.lean)
+
+    if previous_manifest is not None:
+        exported = len(package)
+        removed = removed_notes(previous_manifest, manifest)
+        write_json(removed, f"{args.output}.removed.json")
+        print(f"Delta: {exported} note nuove o modificate, {len(removed)} rimosse "
+              f"(elenco in {args.output}.removed.json)")
+    if len(written) > 1:
+        print(f"Pacchetto diviso in {len(written)} file (indice in {args.output}.shards.json)")
+    print(f"{len(cards)} card da {len(cards.files())} file su {len(files)} -> {', '.join(written)}")
+    print(timer.summary())
+    return 0
+
+
+def scan_files(inputs):
+    """Restituisce {percorso: (nome_sottomazzo, firma)} con firma = (mtime_ns, dimensione)."""
+    snapshot = {}
+    for name, path in find_markdown_files(inputs):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        snapshot[path] = (name, (stat.st_mtime_ns, stat.st_size))
+    return snapshot
+
+
+def wait_until_stable(inputs, snapshot, debounce):
+    """Attende che nessun file cambi per debounce secondi e restituisce lo stato finale.
+
+    Così una raffica di salvataggi produce una sola ricostruzione.
+    """
+    while True:
+        time.sleep(debounce)
+        current = scan_files(inputs)
+        if current == snapshot:
+            return current
+        snapshot = current
+
+
+def watch(args):
+    """Esegue il comando watch: ricostruisce il mazzo a ogni modifica dei file markdown.
+
+    Vengono rielaborati solo i blocchi modificati dei file toccati; le card
+    del resto restano in memoria già renderizzate, quindi il costo di una
+    modifica è quello dei blocchi modificati più la scrittura del pacchetto.
+    """
+    theme = load_theme(args.theme)
+    deck_name = deck_name_for(args)
+    cache = open_cache(args)
+    # Il renderer resta attivo tra una ricostruzione e l'altra: ogni formula viene convertita una volta
+    math_renderer = open_math_renderer(args)
+
+    snapshot = {}
+    store = CardStore()
+    conflict = None
+    print(f"In ascolto su {', '.join(args.inputs)} (Ctrl+C per uscire)")
+    try:
+        while True:
+            try:
+                current = scan_files(args.inputs)
+                if current != snapshot:
+                    current = wait_until_stable(args.inputs, current, args.debounce)
+            except ValueError as error:
+                # File con lo stesso sottomazzo: si attende che vengano rinominati o spostati
+                if str(error) != conflict:
+                    conflict = str(error)
+                    print(f"[{time.strftime('%H:%M:%S')}] {error}", file=sys.stderr)
+                time.sleep(args.interval)
+                continue
+            conflict = None
+
+            if current != snapshot:
+                start = time.perf_counter()
+
+                changed = [path for path, entry in current.items() if snapshot.get(path) != entry]
+                extract_cards(
+                    [(current[path][0], pathlib.Path(path)) for path in changed],
+                    jobs=args.jobs,
+                    cache=cache,
+                    store=store
+                )
+                # Sottomazzi nell'ordine dei file, come in build
+                store.retain_files([name for name, _ in current.values()])
+                snapshot = current
+
+                base_dirs = {name: os.path.dirname(path) for path, (name, _) in current.items()}
+                cards = handle_duplicates(store, args)
+                cards, media_files = collect_images(cards, base_dirs, args)
+                cards, mathjax = prerender_math(cards, math_renderer)
+                if len(cards):
+                    package = create_anki_deck(None, deck_name=deck_name, theme=theme, jobs=args.jobs,
+                                               media_files=media_files, mathjax=mathjax, lean=args.lean,
+                                               cards=cards)
+                    written = write_packages(package, args)
+                    write_manifest(cards, deck_name, theme, args.output, mathjax=mathjax, lean=args.lean)
+                    elapsed = time.perf_counter() - start
+                    print(f"[{time.strftime('%H:%M:%S')}] {len(changed)} file rielaborati, "
+                          f"{len(cards)} card -> {', '.join(written)} ({elapsed:.3f} s)")
+                else:
+                    print(f"[{time.strftime('%H:%M:%S')}] Nessuna domanda e risposta trovata nei file")
+                if cache is not None:
+                    cache.flush()
+
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if cache is not None:
+            cache.close()
+    return 0
+
+
+def add_build_options(subparser):
+    """Aggiunge le opzioni comuni a build e watch."""
+    subparser.add_argument('inputs', nargs='+', help="cartelle (ricorsive), glob o file markdown")
+    subparser.add_argument('-o', '--output', required=True, help="percorso del file .apkg da creare")
+    subparser.add_argument('--deck-name', help="nome del mazzo (default: nome del file di output)")
+    subparser.add_argument('--jobs', type=int, default=None,
+                           help="processi per l'estrazione e la creazione dei sottomazzi (default: tutti i core)")
+    subparser.add_argument('--theme', help="file JSON con il tema delle card")
+    subparser.add_argument('--cache', help="database SQLite della cache di rendering")
+    subparser.add_argument('--max-cards', type=int, help="card massime per pacchetto: oltre il limite il mazzo "
+                                                          "viene diviso in più file")
+    subparser.add_argument('--max-size', type=float, help="dimensione massima di ogni pacchetto in MB")
+    subparser.add_argument('--lean', action='store_true',
+                           help="modello leggero: tema nel CSS, HTML minificato, MathJax solo nelle card con formule")
+    subparser.add_argument('--prerender-math', action='store_true',
+                           help="converte le formule in MathML durante la build: le card non caricano MathJax "
+                                "(richiede latex2mathml)")
+    subparser.add_argument('--format', choices=PACKAGE_FORMATS, default='anki2',
+                           help="formato del pacchetto: anki2 (default, ogni versione di Anki) o anki21b "
+                                "(compresso con zstd, Anki 2.1.50+, richiede zstandard)")
+    subparser.add_argument('--zstd-level', type=int, default=3, help="livello di compressione zstd per anki21b (1-22)")
+    subparser.add_argument('--max-image-size', type=int, help="lato massimo delle immagini in pixel "
+                                                              "(richiede Pillow; default: dimensioni originali)")
+    subparser.add_argument('--image-quality', type=int, default=85, help="qualità JPEG/WebP delle immagini ridimensionate")
+    subparser.add_argument('--dedup', choices=('report', 'merge'),
+                           help="cerca le domande quasi duplicate tra i file: report le elenca in "
+                                "<output>.duplicates.json, merge tiene solo l'ultima di ogni gruppo")
+    subparser.add_argument('--dedup-threshold', type=float, default=0.8,
+                           help="similarità minima (0-1) tra due domande per considerarle duplicate")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='anki-maker', description="Crea mazzi Anki da file Markdown.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="crea un pacchetto .apkg da cartelle, glob o file .md")
+    add_build_options(build_parser)
+    build_parser.add_argument('--since', help="manifest di una build precedente: crea un pacchetto delta con "
+                                               "solo le note nuove o modificate")
+    build_parser.set_defaults(handler=build)
+
+    watch_parser = subparsers.add_parser('watch', help="ricrea il pacchetto a ogni modifica dei file .md")
+    add_build_options(watch_parser)
+    watch_parser.add_argument('--interval', type=float, default=0.5, help="intervallo di controllo dei file in secondi")
+    watch_parser.add_argument('--debounce', type=float, default=0.2, help="secondi senza modifiche prima di ricostruire")
+    watch_parser.set_defaults(handler=watch)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,77 +1,99 @@
+import hashlib
+import json
+
 import genanki
-import random
 
-def get_anki_model(theme, model_id=None):
+# Tema di default delle card
+DEFAULT_THEME = {
+    "question_bg": "#ffffff",
+    "question_fg": "#2c3e50",
+    "answer_bg": "#f8f9fa",
+    "answer_fg": "#2c3e50",
+    "font_family": "Arial, sans-serif",
+    "question_font_size": "16px",
+    "answer_font_size": "14px",
+    "border_radius": "8px",
+    "box_shadow": "0 1px 3px rgba(0,0,0,0.1)"
+}
+
+MODEL_NAME = 'Modello Domanda-Risposta Personalizzato'
+
+# Carica MathJax 2.7 da cdnjs per le formule \\(...\\) non pre-renderizzate
+MATHJAX_SCRIPT = '''            <script type="text/x-mathjax-config">
+                MathJax.Hub.Config({
+                    messageStyle: "none",
+                    tex2jax: {inlineMath: [['\\\\(','\\\\)']]},
+                    displayAlign: "center",
+                    "HTML-CSS": { scale: 100 }
+                });
+            </script>
+            <script type="text/javascript">
+                if (typeof MathJax === "undefined") {
+                    var script = document.createElement("script");
+                    script.type = "text/javascript";
+                    script.src = "https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.1/MathJax.js?config=TeX-AMS_HTML";
+                    document.getElementsByTagName("head")[0].appendChild(script);
+                }
+            </script>
+'''
+
+
+def stable_id(*parts):
+    """Deriva un ID Anki deterministico (nello stesso intervallo degli ID casuali) dalle parti date.
+
+    Le parti vengono serializzate in JSON, quindi possono essere stringhe,
+    numeri, liste o dizionari.
+    """
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    digest = hashlib.blake2b(payload, digest_size=8).digest()
+    return (1 << 30) + int.from_bytes(digest, 'big') % (1 << 30)
+
+
+def get_anki_model(theme, model_id=None, mathjax=True):
     """
     Crea e restituisce un modello Anki configurato.
-    Se model_id non è fornito, ne viene generato uno casuale.
+    Se model_id non è fornito, viene derivato da campi, template e CSS: lo
+    stesso tema produce sempre lo stesso modello, così una reimportazione
+    aggiorna il modello esistente invece di duplicarlo.
+    Con mathjax=False (formule già pre-renderizzate) le card non contengono
+    alcuno script.
     """
-    if model_id is None:
-        model_id = random.randrange(1 << 30, 1 << 31)
-
     # Definizione del tema di default se non fornito
     if theme is None:
-        theme = {
-            "question_bg": "#ffffff",
-            "question_fg": "#2c3e50",
-            "answer_bg": "#f8f9fa",
-            "answer_fg": "#2c3e50",
-            "font_family": "Arial, sans-serif",
-            "question_font_size": "16px",
-            "answer_font_size": "14px",
-            "border_radius": "8px",
-            "box_shadow": "0 1px 3px rgba(0,0,0,0.1)"
-        }
+        theme = dict(DEFAULT_THEME)
 
-    my_model = genanki.Model(
-        model_id,
-        'Modello Domanda-Risposta Personalizzato',
-        fields=[
-            {'name': 'Domanda'},
-            {'name': 'Risposta'},
-        ],
-        templates=[
-            {
-                'name': 'Card 1',
-                'qfmt': f'''
-                <script type="text/x-mathjax-config">
-                    MathJax.Hub.Config({{
-                        messageStyle: "none",
-                        tex2jax: {{inlineMath: [['\\\\(','\\\\)']]}},
-                        displayAlign: "center",
-                        "HTML-CSS": {{ scale: 100 }}
-                    }});
-                </script>
-                <script type="text/javascript">
-                    if (typeof MathJax === "undefined") {{
-                        var script = document.createElement("script");
-                        script.type = "text/javascript";
-                        script.src = "https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.1/MathJax.js?config=TeX-AMS_HTML";
-                        document.getElementsByTagName("head")[0].appendChild(script);
-                    }}
-                </script>
-                <div style="max-width: 600px; margin: 0 auto; font-family: {theme['font_family']}; font-size: {theme['question_font_size']}; 
-                     padding: 20px; background-color: {theme['question_bg']}; color: {theme['question_fg']}; 
-                     border-radius: {theme['border_radius']}; box-shadow: {theme['box_shadow']}; text-align: left;">
-                    {{{{Domanda}}}}
-                </div>
-                ''',
-                'afmt': f'''
-                <div style="max-width: 600px; margin: 0 auto; font-family: {theme['font_family']}; font-size: {theme['question_font_size']}; 
-                     padding: 20px; background-color: {theme['question_bg']}; color: {theme['question_fg']}; 
-                     border-radius: {theme['border_radius']}; box-shadow: {theme['box_shadow']}; text-align: left;">
-                    {{{{Domanda}}}}
-                </div>
-                <hr id="answer" style="max-width: 600px; margin: 10px auto; border: 1px solid #e0e0e0;">
-                <div style="max-width: 600px; margin: 0 auto; font-family: {theme['font_family']}; font-size: {theme['answer_font_size']}; 
-                     padding: 20px; background-color: {theme['answer_bg']}; color: {theme['answer_fg']}; 
-                     border-radius: {theme['border_radius']}; box-shadow: {theme['box_shadow']}; text-align: left;">
-                    {{{{Risposta}}}}
-                </div>
-                ''',
-            },
-        ],
-        css="""
+    mathjax_script = MATHJAX_SCRIPT if mathjax else ''
+
+    fields = [
+        {'name': 'Domanda'},
+        {'name': 'Risposta'},
+    ]
+    templates = [
+        {
+            'name': 'Card 1',
+            'qfmt': f'''
+{mathjax_script}            <div style="max-width: 600px; margin: 0 auto; font-family: {theme['font_family']}; font-size: {theme['question_font_size']}; 
+                 padding: 20px; background-color: {theme['question_bg']}; color: {theme['question_fg']}; 
+                 border-radius: {theme['border_radius']}; box-shadow: {theme['box_shadow']}; text-align: left;">
+                {{{{Domanda}}}}
+            </div>
+            ''',
+            'afmt': f'''
+            <div style="max-width: 600px; margin: 0 auto; font-family: {theme['font_family']}; font-size: {theme['question_font_size']}; 
+                 padding: 20px; background-color: {theme['question_bg']}; color: {theme['question_fg']}; 
+                 border-radius: {theme['border_radius']}; box-shadow: {theme['box_shadow']}; text-align: left;">
+                {{{{Domanda}}}}
+            </div>
+            <hr id="answer" style="max-width: 600px; margin: 10px auto; border: 1px solid #e0e0e0;">
+            <div style="max-width: 600px; margin: 0 auto; font-family: {theme['font_family']}; font-size: {theme['answer_font_size']}; 
+                 padding: 20px; background-color: {theme['answer_bg']}; color: {theme['answer_fg']}; 
+                 border-radius: {theme['border_radius']}; box-shadow: {theme['box_shadow']}; text-align: left;">
+                {{{{Risposta}}}}
+            </div>
+            ''',
+        },
+    ]
+    css = """
         .card {
             text-align: center;
             background-color: #f7f7f7;
@@ -100,8 +122,70 @@ def get_anki_model(theme, model_id=None):
             text-align: center !important; 
             margin: 1em 0em !important;
         }
-        """,
+        """
+
+    if model_id is None:
+        model_id = stable_id('model', MODEL_NAME, fields, templates, css)
+
+    my_model = genanki.Model(
+        model_id,
+        MODEL_NAME,
+        fields=fields,
+        templates=templates,
+        css=css,
+        model_type=0,
+        sort_field_index=0
+    )
+    return my_model
+
+LEAN_MODEL_NAME = 'Modello Domanda-Risposta Leggero'
+
+
+def get_lean_anki_model(theme, model_id=None, mathjax=True):
+    """
+    Crea la variante leggera del modello: il tema sta nel CSS del modello
+    come classi invece che in attributi style= ripetuti in ogni card, il
+    retro riusa il fronte con {{FrontSide}} e lo script di MathJax viene
+    incluso solo nelle note con il campo Math non vuoto (vedi
+    anki_deck_creator.create_anki_deck con lean=True).
+    """
+    if theme is None:
+        theme = dict(DEFAULT_THEME)
+
+    fields = [
+        {'name': 'Domanda'},
+        {'name': 'Risposta'},
+        {'name': 'Math'},
+    ]
+    mathjax_block = '{{#Math}}\n' + MATHJAX_SCRIPT + '{{/Math}}\n' if mathjax else ''
+    templates = [
+        {
+            'name': 'Card 1',
+            'qfmt': mathjax_block + '<div class="question">{{Domanda}}</div>',
+            'afmt': '{{FrontSide}}\n<hr id="answer">\n<div class="answer">{{Risposta}}</div>',
+        },
+    ]
+    css = f""".card {{ text-align: center; background-color: #f7f7f7; padding: 20px 10px; }}
+.question, .answer {{ max-width: 600px; margin: 0 auto; padding: 20px; text-align: left; font-family: {theme['font_family']}; border-radius: {theme['border_radius']}; box-shadow: {theme['box_shadow']}; }}
+.question {{ font-size: {theme['question_font_size']}; background-color: {theme['question_bg']}; color: {theme['question_fg']}; }}
+.answer {{ font-size: {theme['answer_font_size']}; background-color: {theme['answer_bg']}; color: {theme['answer_fg']}; }}
+#answer {{ max-width: 600px; margin: 10px auto; border: 1px solid #e0e0e0; }}
+code {{ background-color: #f5f5f5; padding: 2px 4px; border-radius: 4px; font-family: "Courier New", monospace; }}
+mark {{ background-color: #fff3cd; padding: 2px 4px; border-radius: 2px; }}
+ul, ol {{ margin-left: 20px; padding-left: 0; text-align: left; }}
+li {{ margin: 5px 0; }}
+.MathJax_Display {{ text-align: center !important; margin: 1em 0em !important; }}
+"""
+
+    if model_id is None:
+        model_id = stable_id('model', LEAN_MODEL_NAME, fields, templates, css)
+
+    return genanki.Model(
+        model_id,
+        LEAN_MODEL_NAME,
+        fields=fields,
+        templates=templates,
+        css=css,
         model_type=0,
         sort_field_index=0
     )
-    return my_model
\ No newline at end of file
@@ -0,0 +1,53 @@
+"""Benchmark di scalabilità di extract_qa_from_markdown.
+
+Genera un unico blocco (senza separatori ---) con un numero crescente di
+marcatori Domanda/Risposta e misura il tempo di estrazione. Con il tokenizer
+a passata singola il tempo per marcatore deve restare circa costante.
+
+Uso:
+    python benchmarks/bench_extract_scaling.py [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qa_extractor import extract_qa_from_markdown
+
+
+def build_block(n_pairs):
+    """Costruisce un blocco con n_pairs coppie e qualche domanda senza risposta."""
+    lines = []
+    for i in range(n_pairs):
+        lines.append(f"**Domanda:** Quanto vale $x_{i}$ nel caso {i}?")
+        if i % 10 == 9:
+            # Domanda orfana: viene saltata ma deve comunque essere scandita
+            lines.append(f"Domanda: bozza {i}")
+            lines.append(f"Domanda: Cosa restituisce `f({i})`?")
+        lines.append(f"**Risposta corretta:** Il valore è **{i}**, vedi ==nota {i}==.")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3, help="ripetizioni per misura (si tiene il minimo)")
+    args = parser.parse_args()
+
+    print(f"{'coppie':>8} {'marcatori':>10} {'tempo (ms)':>12} {'µs/marcatore':>14}")
+    for n_pairs in (100, 200, 400, 800, 1600, 3200):
+        block = build_block(n_pairs)
+        n_markers = 2 * n_pairs + 2 * (n_pairs // 10)
+
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            extract_qa_from_markdown(block)
+            best = min(best, time.perf_counter() - start)
+
+        print(f"{n_pairs:>8} {n_markers:>10} {best * 1000:>12.2f} {best * 1e6 / n_markers:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Generatore deterministico di appunti Domanda/Risposta in italiano per i benchmark.
+
+Il corpus imita gli appunti reali: marcatori in grassetto e non, formule
+$...$, codice inline e a blocchi, liste puntate e numerate, blocchi separati
+da --- e qualche domanda orfana senza risposta.
+"""
+import random
+
+_TOPICS = [
+    "processo", "thread", "semaforo", "deadlock", "memoria virtuale", "paginazione",
+    "limite", "derivata", "integrale", "serie geometrica", "matrice inversa", "autovalore",
+    "albero binario", "tabella hash", "grafo orientato", "ordinamento", "ricorsione",
+    "transazione", "chiave esterna", "normalizzazione", "indice", "protocollo TCP",
+]
+_WORDS = (
+    "il la un una che di del della nel per con sono viene quando ogni due tre "
+    "valore sistema funzione caso esempio tempo insieme elemento risultato "
+    "costo spazio nodo stato regola proprietà condizione definizione metodo"
+).split()
+_FORMULAS = [
+    r"O(n \log n)", r"\frac{a}{b}", r"x^2 + y^2 = r^2", r"\sum_{i=1}^{n} i",
+    r"\int_0^1 f(x)\,dx", r"\lim_{x \to 0} \frac{\sin x}{x} = 1", r"A^{-1}A = I",
+]
+_SNIPPETS = ["fork()", "malloc(n)", "SELECT * FROM t", "x = x + 1", "len(xs)", "a[i] < a[j]"]
+
+
+def _sentence(rng, min_words=6, max_words=16):
+    words = [rng.choice(_WORDS) for _ in range(rng.randint(min_words, max_words))]
+    # Formattazione inline sparsa
+    roll = rng.random()
+    i = rng.randrange(len(words))
+    if roll < 0.25:
+        words[i] = f"**{words[i]}**"
+    elif roll < 0.4:
+        words[i] = f"*{words[i]}*"
+    elif roll < 0.5:
+        words[i] = f"=={words[i]}=="
+    elif roll < 0.7:
+        words[i] = f"${rng.choice(_FORMULAS)}$"
+    elif roll < 0.85:
+        words[i] = f"`{rng.choice(_SNIPPETS)}`"
+    text = " ".join(words)
+    return text[0].upper() + text[1:] + "."
+
+
+def _answer(rng):
+    kind = rng.random()
+    if kind < 0.15:
+        items = "\n".join(f"- {_sentence(rng, 3, 8)}" for _ in range(rng.randint(2, 5)))
+        return f"{_sentence(rng)}\n{items}"
+    if kind < 0.25:
+        items = "\n".join(f"{n}. {_sentence(rng, 3, 8)}" for n in range(1, rng.randint(3, 6)))
+        return f"{_sentence(rng)}\n{items}"
+    if kind < 0.33:
+        code = "\n".join(rng.choice(_SNIPPETS) for _ in range(rng.randint(2, 5)))
+        return f"{_sentence(rng)}\n```\n{code}\n```"
+    return " ".join(_sentence(rng) for _ in range(rng.randint(1, 3)))
+
+
+def _card(rng, index):
+    topic = rng.choice(_TOPICS)
+    question = f"Che cos'è {topic} ({index})? {_sentence(rng, 3, 8)}"
+    if rng.random() < 0.5:
+        card = f"**Domanda:** {question}\n**Risposta:** {_answer(rng)}"
+    else:
+        label = "Risposta corretta" if rng.random() < 0.2 else "Risposta"
+        card = f"Domanda: {question}\n{label}: {_answer(rng)}"
+    if rng.random() < 0.03:
+        # Domanda orfana: viene scartata dall'estrattore
+        card = f"Domanda: bozza su {topic}?\n{card}"
+    return card
+
+
+def generate_markdown(n_cards, seed=0, cards_per_block=(1, 4)):
+    """Genera appunti markdown con n_cards coppie domanda/risposta.
+
+    Args:
+        n_cards: Numero di coppie da generare
+        seed: Seme del generatore casuale: lo stesso seme produce lo stesso testo
+        cards_per_block: Intervallo (min, max) di coppie per blocco ---
+
+    Returns:
+        Il contenuto markdown come stringa
+    """
+    rng = random.Random(seed)
+    blocks = []
+    produced = 0
+    while produced < n_cards:
+        count = min(rng.randint(*cards_per_block), n_cards - produced)
+        blocks.append("\n\n".join(_card(rng, produced + i) for i in range(count)))
+        produced += count
+    separators = ["\n\n---\n\n", "\n---\n", "\n  ---  \n"]
+    parts = []
+    for i, block in enumerate(blocks):
+        if i:
+            parts.append(rng.choice(separators))
+        parts.append(block)
+    return "".join(parts)
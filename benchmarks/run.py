@@ -0,0 +1,178 @@
+"""Benchmark per fase della pipeline markdown -> pacchetto Anki.
+
+Misura tempo e picco di memoria di ogni fase (split, match, pair, render,
+escape, note build, package write) su corpus sintetici di varie dimensioni e
+salva i risultati in JSON, confrontandoli opzionalmente con un run di
+riferimento.
+
+Uso:
+    python -m benchmarks.run --sizes 1000 10000 100000 -o results.json
+    python -m benchmarks.run --baseline results.json --fail-on-regression
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import generate_markdown
+from qa_extractor import (
+    _iter_block_pairs,
+    _iter_blocks,
+    _tokenize_block,
+    escape_anki_html,
+    transform_math_formulas,
+)
+
+try:
+    from anki_deck_creator import create_anki_deck
+except ImportError:  # genanki non installato: le fasi del pacchetto vengono saltate
+    create_anki_deck = None
+
+STAGES = ("split", "match", "pair", "render", "escape", "note build", "package write")
+
+
+def _pipeline(content, output_dir):
+    """Esegue la pipeline una fase alla volta, producendo (nome_fase, funzione) in ordine."""
+    state = {}
+
+    def split():
+        state["blocks"] = [block.strip() for block in _iter_blocks((content,))]
+
+    def match():
+        state["segments"] = [_tokenize_block(block) for block in state["blocks"] if block]
+
+    def pair():
+        state["pairs"] = [pair for segments in state["segments"] for pair in _iter_block_pairs(segments)]
+
+    def render():
+        state["rendered"] = [(transform_math_formulas(q), transform_math_formulas(a)) for q, a in state["pairs"]]
+
+    def escape():
+        state["qa_dict"] = {escape_anki_html(q): escape_anki_html(a) for q, a in state["rendered"]}
+
+    def note_build():
+        state["package"] = create_anki_deck(state["qa_dict"], deck_name="Benchmark")
+
+    def package_write():
+        state["package"].write_to_file(os.path.join(output_dir, "benchmark.apkg"))
+
+    stages = [("split", split), ("match", match), ("pair", pair), ("render", render), ("escape", escape)]
+    if create_anki_deck is not None:
+        stages += [("note build", note_build), ("package write", package_write)]
+    return stages, state
+
+
+def run_size(n_cards, seed, measure_memory=True):
+    """Esegue il benchmark su un corpus di n_cards coppie.
+
+    Il tempo viene misurato senza tracemalloc (che rallenta l'esecuzione);
+    il picco di memoria viene misurato in una seconda esecuzione.
+
+    Returns:
+        Dizionario con il numero di card estratte e, per ogni fase, secondi e
+        picco di memoria in byte
+    """
+    content = generate_markdown(n_cards, seed=seed)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        stages, state = _pipeline(content, output_dir)
+        for name, stage in stages:
+            start = time.perf_counter()
+            stage()
+            results[name] = {"seconds": time.perf_counter() - start}
+        cards = len(state["qa_dict"])
+
+        if measure_memory:
+            stages, state = _pipeline(content, output_dir)
+            tracemalloc.start()
+            try:
+                for name, stage in stages:
+                    tracemalloc.reset_peak()
+                    baseline, _ = tracemalloc.get_traced_memory()
+                    stage()
+                    _, peak = tracemalloc.get_traced_memory()
+                    results[name]["peak_bytes"] = peak - baseline
+            finally:
+                tracemalloc.stop()
+
+    return {"cards": cards, "input_bytes": len(content.encode("utf-8")), "stages": results}
+
+
+def compare(results, baseline, tolerance):
+    """Stampa il confronto con un run di riferimento e restituisce le fasi peggiorate."""
+    regressions = []
+    print(f"\n{'card':>8} {'fase':<14} {'rif. (s)':>10} {'ora (s)':>10} {'rapporto':>9}")
+    for size, current in results.items():
+        reference = baseline.get("results", {}).get(size)
+        if reference is None:
+            continue
+        for stage in STAGES:
+            if stage not in current["stages"] or stage not in reference["stages"]:
+                continue
+            old = reference["stages"][stage]["seconds"]
+            new = current["stages"][stage]["seconds"]
+            ratio = new / old if old else float("inf")
+            flag = ""
+            if ratio > 1 + tolerance:
+                regressions.append((size, stage, ratio))
+                flag = "  <-- più lento"
+            print(f"{size:>8} {stage:<14} {old:>10.4f} {new:>10.4f} {ratio:>9.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="numero di card per corpus")
+    parser.add_argument("--seed", type=int, default=0, help="seme del generatore del corpus")
+    parser.add_argument("-o", "--output", help="file JSON in cui salvare i risultati")
+    parser.add_argument("--baseline", help="file JSON di un run precedente con cui confrontarsi")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="peggioramento relativo tollerato (0.2 = 20%%)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="esce con codice 1 se una fase peggiora")
+    parser.add_argument("--no-memory", action="store_true", help="non misura il picco di memoria")
+    args = parser.parse_args(argv)
+
+    if create_anki_deck is None:
+        print("genanki non installato: le fasi 'note build' e 'package write' vengono saltate")
+
+    results = {}
+    print(f"{'card':>8} {'fase':<14} {'tempo (s)':>10} {'picco (MiB)':>12}")
+    for size in args.sizes:
+        result = run_size(size, args.seed, measure_memory=not args.no_memory)
+        results[str(size)] = result
+        for stage, values in result["stages"].items():
+            peak = values.get("peak_bytes")
+            peak_text = f"{peak / 2**20:>12.2f}" if peak is not None else f"{'-':>12}"
+            print(f"{size:>8} {stage:<14} {values['seconds']:>10.4f} {peak_text}")
+
+    report = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nRisultati salvati in {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+"""Archivio indicizzato delle card estratte.
+
+Sostituisce il dizionario {domanda HTML: risposta HTML} come struttura di
+lavoro dell'applicazione: ogni card ha un identificativo intero stabile,
+conserva file e riga di origine e i campi grezzi (markdown) accanto a quelli
+renderizzati, ed è raggiungibile in O(1) per posizione o per identificativo.
+Le modifiche dall'anteprima avvengono sul posto, senza spostare la card in
+fondo né copiare il resto del mazzo.
+
+Per ogni file l'archivio conserva anche la mappa sorgente dell'ultima
+estrazione (vedi qa_extractor._extract_blocks): hash e posizione di ogni
+blocco con le card che contiene. Rielaborando un file modificato solo i
+blocchi cambiati producono card nuove; quelle dei blocchi invariati restano
+gli stessi oggetti, con identificativi e modifiche.
+"""
+# Card di cui caricare i campi insieme a quella richiesta, se l'archivio è pigro
+FIELD_PAGE = 256
+
+
+class Card:
+    """Una card: campi grezzi e renderizzati con la loro origine.
+
+    Attributes:
+        id: Identificativo intero stabile all'interno del CardStore
+        file: Nome del file di origine
+        line: Riga (da 1) del file in cui compare la domanda
+        raw_question, raw_answer: Campi markdown così come scritti negli appunti
+        question, answer: Campi HTML compatibili con Anki
+        block: Indice del blocco del file che contiene la card
+        offset: Offset in byte UTF-8 del marcatore "Domanda" nel file
+        block_hash: Hash del testo del blocco (None se non noto)
+    """
+
+    __slots__ = ('id', 'file', 'line', 'raw_question', 'raw_answer', 'question', 'answer',
+                 'block', 'offset', 'block_hash')
+
+    def __init__(self, id, file, line, raw_question, raw_answer, question, answer,
+                 block=None, offset=None, block_hash=None):
+        self.id = id
+        self.file = file
+        self.line = line
+        self.raw_question = raw_question
+        self.raw_answer = raw_answer
+        self.question = question
+        self.answer = answer
+        self.block = block
+        self.offset = offset
+        self.block_hash = block_hash
+
+    def __repr__(self):
+        return f"Card(id={self.id}, file={self.file!r}, line={self.line})"
+
+
+class CardStore:
+    """Card di un progetto nell'ordine dei file, con indici per file e per identificativo.
+
+    All'interno di un file valgono le regole del qa_dict per file: una
+    domanda ripetuta aggiorna la card esistente (vince l'ultima risposta, la
+    posizione resta quella della prima). Tra file diversi le card restano
+    distinte; in qa_dict() a parità di domanda vince l'ultimo file.
+
+    Le operazioni strutturali (set_file, retain_files) ricostruiscono gli
+    indici posizionali alla prima lettura successiva, una sola volta per
+    quante modifiche siano state fatte nel frattempo.
+
+    Args:
+        fields_loader: Funzione lista_id -> {id: (domanda_grezza,
+            risposta_grezza, domanda, risposta)} per le card aggiunte con
+            add_lazy_file, i cui campi vengono caricati a pagine di
+            FIELD_PAGE card solo quando servono (vedi project_store)
+        next_id: Primo identificativo da assegnare alle card nuove
+    """
+
+    def __init__(self, fields_loader=None, next_id=1):
+        self._by_file = {}        # nome file -> lista di Card nell'ordine del file
+        self._sources = {}        # nome file -> mappa sorgente (vedi set_file)
+        self._block_index = {}    # nome file -> [(hash, riga, offset)] dei file pigri
+        self._cards = []          # posizione -> Card
+        self._positions = {}      # id -> posizione
+        self._next_id = next_id
+        self._dirty = False
+        self._fields_loader = fields_loader
+        self._unloaded = 0        # card aggiunte senza campi (stima per eccesso)
+
+    def _reindex(self):
+        self._cards = [card for cards in self._by_file.values() for card in cards]
+        self._positions = {card.id: position for position, card in enumerate(self._cards)}
+        self._dirty = False
+
+    def _index(self):
+        if self._dirty:
+            self._reindex()
+        return self._cards
+
+    def _load_fields(self, cards):
+        """Carica i campi mancanti delle card date e restituisce le card."""
+        if not self._unloaded:
+            return cards
+        missing = [card for card in cards if card.question is None]
+        if missing:
+            fields = self._fields_loader([card.id for card in missing])
+            for card in missing:
+                card.raw_question, card.raw_answer, card.question, card.answer = fields[card.id]
+            self._unloaded -= len(missing)
+        if cards is self._cards:
+            self._unloaded = 0
+        return cards
+
+    def __len__(self):
+        return len(self._index())
+
+    def __getitem__(self, position):
+        cards = self._index()
+        card = cards[position]
+        if card.question is None:
+            start = self._positions[card.id] // FIELD_PAGE * FIELD_PAGE
+            self._load_fields(cards[start:start + FIELD_PAGE])
+        return card
+
+    def __iter__(self):
+        return iter(self._load_fields(self._index()))
+
+    def get(self, card_id):
+        """Card con l'identificativo dato (KeyError se non esiste)."""
+        self._index()
+        return self[self._positions[card_id]]
+
+    def position(self, card_id):
+        """Posizione corrente della card con l'identificativo dato."""
+        self._index()
+        return self._positions[card_id]
+
+    def files(self):
+        """Nomi dei file con almeno una card, nell'ordine dei file."""
+        return [file_name for file_name, cards in self._by_file.items() if cards]
+
+    def iter_files(self):
+        """Produce (nome_file, card) per ogni file con almeno una card, nell'ordine dei file."""
+        self._load_fields(self._index())
+        for file_name, cards in self._by_file.items():
+            if cards:
+                yield file_name, cards
+
+    def cards_in_file(self, file_name):
+        """Card di un file nell'ordine in cui compaiono (lista vuota se il file manca)."""
+        self._index()
+        return list(self._load_fields(self._by_file.get(file_name, [])))
+
+    def set_file(self, file_name, blocks):
+        """Sostituisce le card di un file mantenendone la posizione tra i file.
+
+        Una card del file precedente il cui blocco è rimasto identico (stesso
+        hash e stessa domanda grezza) viene conservata: cambiano solo la sua
+        posizione nel file e l'indice del blocco, mentre identificativo e
+        campi, comprese le modifiche fatte a mano, restano quelli di prima.
+
+        Args:
+            file_name: Nome del file; se nuovo viene aggiunto in fondo
+            blocks: Mappa sorgente del file, lista di tuple (hash, riga,
+                offset, card) come prodotta da qa_extractor._extract_blocks
+        """
+        previous = {
+            (card.block_hash, card.raw_question): card
+            for card in self._load_fields(self._by_file.get(file_name, []))
+            if card.block_hash is not None
+        }
+        # Domanda -> record che la definisce (l'ultimo), nell'ordine della prima occorrenza
+        records = {}
+        for index, (block_hash, block_line, block_offset, cards) in enumerate(blocks):
+            for line, offset, raw_question, raw_answer, question, answer in cards:
+                records[question] = (block_line + line, raw_question, raw_answer, answer,
+                                     index, block_offset + offset, block_hash)
+
+        cards = []
+        for question, (line, raw_question, raw_answer, answer, index, offset, block_hash) in records.items():
+            card = previous.pop((block_hash, raw_question), None)
+            if card is None:
+                card = Card(self._next_id, file_name, line, raw_question, raw_answer, question, answer,
+                            index, offset, block_hash)
+                self._next_id += 1
+            else:
+                card.line, card.block, card.offset = line, index, offset
+            cards.append(card)
+        self._by_file[file_name] = cards
+        self._sources[file_name] = blocks
+        self._block_index.pop(file_name, None)
+        self._dirty = True
+
+    def add_lazy_file(self, file_name, rows, block_index=None):
+        """Aggiunge le card di un file senza caricarne i campi (vedi fields_loader).
+
+        Args:
+            file_name: Nome del file, aggiunto in fondo
+            rows: Iterabile di tuple (id, riga, blocco, offset, hash_blocco)
+                nell'ordine del file
+            block_index: Lista di tuple (hash, riga, offset) dei blocchi del
+                file (vedi source_index), da cui file_blocks ricostruisce la
+                mappa sorgente; None se non disponibile
+        """
+        cards = [
+            Card(card_id, file_name, line, None, None, None, None, block, offset, block_hash)
+            for card_id, line, block, offset, block_hash in rows
+        ]
+        if cards:
+            self._next_id = max(self._next_id, max(card.id for card in cards) + 1)
+        self._by_file[file_name] = cards
+        if block_index is not None:
+            self._block_index[file_name] = block_index
+        self._unloaded += len(cards)
+        self._dirty = True
+
+    def file_blocks(self, file_name):
+        """Mappa sorgente dell'ultima estrazione di un file (vedi set_file), None se non nota.
+
+        Per un file aggiunto con add_lazy_file la mappa viene ricostruita
+        dall'indice dei blocchi e dalle card, caricandone i campi.
+        """
+        blocks = self._sources.get(file_name)
+        if blocks is None and file_name in self._block_index:
+            block_index = self._block_index.pop(file_name)
+            cards = [[] for _ in block_index]
+            for card in sorted(self._load_fields(self._by_file[file_name]), key=lambda card: card.offset):
+                _, line, offset = block_index[card.block]
+                cards[card.block].append((card.line - line, card.offset - offset, card.raw_question,
+                                          card.raw_answer, card.question, card.answer))
+            blocks = self._sources[file_name] = [
+                (block_hash, line, offset, block_cards)
+                for (block_hash, line, offset), block_cards in zip(block_index, cards)
+            ]
+        return blocks
+
+    def source_index(self, file_name):
+        """Hash e posizione dei blocchi di un file, da salvare per ricostruire la mappa sorgente.
+
+        Returns:
+            Lista di tuple (hash, riga, offset), oppure None se la mappa non è
+            nota o non si può ricostruire dalle sole card: accade se nel file
+            una domanda ripetuta ha assorbito un'altra occorrenza
+        """
+        blocks = self._sources.get(file_name)
+        if blocks is None:
+            return self._block_index.get(file_name)
+        if sum(len(cards) for _, _, _, cards in blocks) != len(self._by_file[file_name]):
+            return None
+        return [(block_hash, line, offset) for block_hash, line, offset, _ in blocks]
+
+    def retain_files(self, file_names):
+        """Tiene solo i file indicati, nell'ordine dato; i nomi sconosciuti vengono ignorati."""
+        self._by_file = {name: self._by_file[name] for name in file_names if name in self._by_file}
+        self._sources = {name: blocks for name, blocks in self._sources.items() if name in self._by_file}
+        self._block_index = {name: index for name, index in self._block_index.items() if name in self._by_file}
+        self._dirty = True
+
+    def update(self, card_id, question=None, answer=None, raw_question=None, raw_answer=None):
+        """Modifica sul posto i campi di una card; i campi None restano invariati.
+
+        Returns:
+            La card modificata
+        """
+        card = self.get(card_id)
+        if question is not None:
+            card.question = question
+        if answer is not None:
+            card.answer = answer
+        if raw_question is not None:
+            card.raw_question = raw_question
+        if raw_answer is not None:
+            card.raw_answer = raw_answer
+        return card
+
+    def map_fields(self, transform):
+        """Nuovo CardStore con i campi renderizzati trasformati.
+
+        Serve alle fasi successive all'estrazione (media, formule), che
+        riscrivono l'HTML delle card senza toccare l'archivio di partenza.
+        Identificativi, origine e campi grezzi restano quelli originali.
+
+        Args:
+            transform: Funzione (nome_file, html) -> html
+        """
+        store = CardStore()
+        store._next_id = self._next_id
+        self._load_fields(self._index())
+        for file_name, cards in self._by_file.items():
+            store._by_file[file_name] = [
+                Card(card.id, file_name, card.line, card.raw_question, card.raw_answer,
+                     transform(file_name, card.question), transform(file_name, card.answer),
+                     card.block, card.offset, card.block_hash)
+                for card in cards
+            ]
+        store._dirty = True
+        return store
+
+    def without(self, card_ids):
+        """Nuovo CardStore senza le card con gli identificativi dati.
+
+        Le card rimaste sono condivise con l'archivio di partenza.
+        """
+        card_ids = set(card_ids)
+        store = CardStore()
+        store._next_id = self._next_id
+        self._load_fields(self._index())
+        for file_name, cards in self._by_file.items():
+            store._by_file[file_name] = [card for card in cards if card.id not in card_ids]
+        store._dirty = True
+        return store
+
+    def qa_dict_per_file(self):
+        """Vista {nome_file: {domanda: risposta}} come quella di extract_many."""
+        return {
+            file_name: {card.question: card.answer for card in cards}
+            for file_name, cards in self.iter_files()
+        }
+
+    def qa_dict(self):
+        """Vista {domanda: risposta} di tutte le card; a parità di domanda vince l'ultimo file."""
+        return {card.question: card.answer for card in self}
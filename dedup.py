@@ -0,0 +1,194 @@
+"""Ricerca delle domande quasi duplicate tra file diversi (MinHash con LSH).
+
+Le domande vengono normalizzate (formattazione, maiuscole, spazi e
+punteggiatura non contano) e ridotte a una firma MinHash sui loro
+n-grammi di caratteri. Il locality-sensitive hashing a bande propone come
+candidate solo le domande con firme simili, che vengono poi confrontate
+esattamente: il costo cresce in modo circa lineare con il numero di card.
+
+Formule e operatori restano intatti, e due domande possono essere
+duplicate solo se contengono gli stessi numeri e le stesse formule:
+"derivata di $x^2$" e "derivata di $x^3$" restano distinte anche se quasi
+tutti i loro n-grammi coincidono.
+
+La firma usa una sola funzione di hash per n-gramma (one permutation
+hashing): gli n-grammi si dividono in bucket e ogni bucket tiene il minimo,
+con i bucket vuoti riempiti dal successivo (densificazione per rotazione).
+"""
+import re
+import zlib
+
+from anki_deck_creator import question_key
+
+# Parametri di default: con 8 bande da 4 righe una coppia con Jaccard 0.8
+# diventa candidata nel 98% dei casi, una con Jaccard 0.3 nel 6%
+SHINGLE_SIZE = 4
+BANDS = 8
+ROWS = 4
+
+# Punteggiatura ignorata: tutto tranne lettere, cifre, spazi e operatori
+_PUNCTUATION_RE = re.compile(r'[^\w\s+\-*/^=<>%]+')
+_WHITESPACE_RE = re.compile(r'\s+')
+# Formule renderizzate \(...\) e \[...\], oppure $...$ rimaste nel testo
+_FORMULA_RE = re.compile(r'\\\((.+?)\\\)|\\\[(.+?)\\\]|\$\$(.+?)\$\$|\$([^$]+)\$', re.DOTALL)
+_NUMBER_RE = re.compile(r'\d+')
+_EMPTY = 1 << 32
+
+
+def _normalize(domanda):
+    """Testo normalizzato di una domanda e le sue ancore (formule, numeri).
+
+    Fuori dalle formule la punteggiatura diventa uno spazio; ogni formula
+    resta com'è, senza spazi, tra $.
+    """
+    key = question_key(domanda)
+    parts = []
+    formulas = []
+    end = 0
+    for match in _FORMULA_RE.finditer(key):
+        parts.append(_PUNCTUATION_RE.sub(' ', key[end:match.start()]))
+        formula = _WHITESPACE_RE.sub('', next(group for group in match.groups() if group is not None))
+        formulas.append(formula)
+        parts.append(f' ${formula}$ ')
+        end = match.end()
+    parts.append(_PUNCTUATION_RE.sub(' ', key[end:]))
+    text = _WHITESPACE_RE.sub(' ', ''.join(parts)).strip()
+    return text, (tuple(formulas), tuple(_NUMBER_RE.findall(text)))
+
+
+def normalize_question(domanda):
+    """Testo confrontato: la chiave di question_key senza punteggiatura, con formule e operatori intatti."""
+    return _normalize(domanda)[0]
+
+
+def _shingles(text, size):
+    """Insieme degli n-grammi di caratteri del testo (il testo intero se più corto)."""
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _signature(shingles, slots):
+    """Firma MinHash a una permutazione con slots valori (slots potenza di 2)."""
+    shift = slots.bit_length() - 1
+    mask = slots - 1
+    signature = [_EMPTY] * slots
+    for value in map(zlib.crc32, map(str.encode, shingles)):
+        slot = value & mask
+        value >>= shift
+        if value < signature[slot]:
+            signature[slot] = value
+
+    # Densificazione: un bucket vuoto prende il valore del primo bucket pieno
+    # che lo segue, distinto dalla distanza perché bucket diversi non collidano
+    if _EMPTY in signature:
+        for slot in range(slots):
+            if signature[slot] == _EMPTY:
+                for distance in range(1, slots):
+                    value = signature[(slot + distance) % slots]
+                    if value < _EMPTY:
+                        signature[slot] = value + distance * _EMPTY
+                        break
+    return signature
+
+
+def _similar(a, b, threshold):
+    """True se la similarità di Jaccard tra a e b raggiunge threshold."""
+    size_a, size_b = len(a), len(b)
+    # Limite superiore dato dalle sole dimensioni: evita l'intersezione
+    if min(size_a, size_b) < threshold * max(size_a, size_b):
+        return False
+    common = len(a & b)
+    return common >= threshold * (size_a + size_b - common)
+
+
+def find_near_duplicates(cards, threshold=0.8, shingle_size=SHINGLE_SIZE, bands=BANDS, rows=ROWS):
+    """Raggruppa le card con domande quasi uguali.
+
+    Args:
+        cards: card_store.CardStore da esaminare
+        threshold: Similarità di Jaccard minima tra gli n-grammi delle domande
+            normalizzate perché due card siano duplicate (1.0: solo domande
+            uguali dopo la normalizzazione). In ogni caso le domande devono
+            contenere gli stessi numeri e le stesse formule
+        shingle_size: Lunghezza degli n-grammi di caratteri
+        bands, rows: Bande del LSH e valori della firma per banda; bands * rows
+            deve essere una potenza di 2
+
+    Returns:
+        Lista di gruppi di almeno due card, ognuno nell'ordine dell'archivio,
+        ordinati per posizione della prima card
+    """
+    slots = bands * rows
+    if slots & (slots - 1):
+        raise ValueError("bands * rows deve essere una potenza di 2")
+
+    cards = list(cards)
+    parent = list(range(len(cards)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # Domande identiche dopo la normalizzazione: un solo rappresentante
+    # (il testo normalizzato contiene già formule e numeri)
+    representatives = {}
+    anchors = {}
+    for i, card in enumerate(cards):
+        text, card_anchors = _normalize(card.question)
+        first = representatives.setdefault(text, i)
+        if first != i:
+            parent[i] = first
+        else:
+            anchors[i] = card_anchors
+
+    shingles = {}
+    buckets = {}
+    checked = set()  # coppie già confrontate in un'altra banda
+    for text, i in representatives.items():
+        shingles[i] = _shingles(text, shingle_size)
+        signature = _signature(shingles[i], slots)
+        for band in range(bands):
+            # Le ancore fanno parte della chiave: domande con numeri o formule
+            # diversi non finiscono mai nello stesso bucket
+            key = (band, anchors[i], *signature[band * rows:(band + 1) * rows])
+            # Ogni card viene confrontata solo con la prima del suo bucket:
+            # i bucket affollati non producono un numero quadratico di coppie
+            first = buckets.setdefault(key, i)
+            if first == i:
+                continue
+            root_i, root_first = find(i), find(first)
+            if root_i == root_first or (first, i) in checked:
+                continue
+            checked.add((first, i))
+            if _similar(shingles[i], shingles[first], threshold):
+                parent[max(root_i, root_first)] = min(root_i, root_first)
+
+    clusters = {}
+    for i in range(len(cards)):
+        clusters.setdefault(find(i), []).append(cards[i])
+    return [cluster for cluster in clusters.values() if len(cluster) > 1]
+
+
+def dropped_cards(clusters):
+    """Card che merge_near_duplicates scarterebbe, da mostrare prima di applicarlo.
+
+    Returns:
+        Lista di tuple (card_scartata, card_tenuta) nell'ordine dei gruppi
+    """
+    return [(card, cluster[-1]) for cluster in clusters for card in cluster[:-1]]
+
+
+def merge_near_duplicates(cards, clusters):
+    """Tiene una sola card per gruppo di duplicati: l'ultima, come in CardStore.qa_dict().
+
+    Args:
+        cards: card_store.CardStore di partenza, che resta invariato
+        clusters: Gruppi prodotti da find_near_duplicates
+
+    Returns:
+        Nuovo CardStore senza le card scartate
+    """
+    return cards.without(card.id for card, _ in dropped_cards(clusters))
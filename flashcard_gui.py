@@ -9,9 +9,15 @@ import genanki
 import random
 from io import BytesIO
 import tempfile
+import shutil
+import time
 import zipfile
-from qa_extractor import extract_qa_from_markdown
-from anki_deck_creator import create_anki_deck # Importa la funzione
+from qa_extractor import extract_cards_incremental
+from anki_deck_creator import PACKAGE_FORMATS, create_anki_deck, shard_file_names, shard_index, shard_package, write_package_to_stream # Importa le funzioni
+from dedup import dropped_cards, find_near_duplicates, merge_near_duplicates
+from media_pipeline import MediaCollector
+from project_store import ProjectStore, StaleProjectError, is_empty_project
+from render_cache import RenderCache
 
 # Configurazione della pagina
 st.set_page_config(
@@ -167,11 +173,137 @@ st.markdown("""
 # La funzione create_anki_deck è stata spostata in anki_deck_creator.py
 # e viene importata da lì.
 
+@st.cache_resource
+def get_render_cache():
+    """Cache di rendering condivisa tra le sessioni, persistita nella cartella temporanea."""
+    return RenderCache(db_path=os.path.join(tempfile.gettempdir(), "flashcard_render_cache.sqlite"))
+
+render_cache = get_render_cache()
+
+@st.cache_resource
+def get_math_renderer():
+    """Renderer delle formule condiviso: ogni formula viene convertita una sola volta."""
+    from math_prerender import MathPrerenderer
+    return MathPrerenderer()
+
+def user_data_dir():
+    """Cartella dei dati dell'utente per l'applicazione, secondo le convenzioni del sistema."""
+    if os.name == "nt":
+        base = os.environ.get("APPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.path.join(base, "flashcard_creator")
+
+# I progetti sopravvivono al riavvio del server e al ricaricamento della pagina
+PROJECTS_DIR = os.environ.get("FLASHCARD_PROJECTS_DIR") or os.path.join(user_data_dir(), "progetti")
+LAST_PROJECT_FILE = os.path.join(PROJECTS_DIR, "ultimo_progetto.txt")
+# Cartella temporanea usata dalle versioni precedenti
+LEGACY_PROJECTS_DIR = os.path.join(tempfile.gettempdir(), "flashcard_projects")
+# Un progetto vuoto viene eliminato solo se inutilizzato da almeno un giorno:
+# potrebbe essere appena stato aperto da un'altra sessione
+EMPTY_PROJECT_MAX_AGE = 24 * 3600
+
+def project_name_for(name):
+    """Nome del progetto così come viene salvato su disco."""
+    return re.sub(r'[^\w.-]+', '_', name.strip()) or "default"
+
+def project_path(name):
+    return os.path.join(PROJECTS_DIR, f"{project_name_for(name)}.sqlite")
+
+def list_projects():
+    """Nomi dei progetti salvati, in ordine alfabetico."""
+    if not os.path.isdir(PROJECTS_DIR):
+        return []
+    return sorted(file_name[:-len(".sqlite")] for file_name in os.listdir(PROJECTS_DIR) if file_name.endswith(".sqlite"))
+
+def last_project():
+    """Ultimo progetto aperto, da cui riparte una sessione senza progetto nell'URL."""
+    try:
+        with open(LAST_PROJECT_FILE, encoding="utf-8") as f:
+            return f.read().strip() or "default"
+    except OSError:
+        return "default"
+
+def prune_empty_projects(keep):
+    """Elimina i progetti senza file né modifiche non usati da EMPTY_PROJECT_MAX_AGE secondi."""
+    for name in list_projects():
+        if name == keep:
+            continue
+        path = project_path(name)
+        paths = [path + suffix for suffix in ("", "-wal", "-shm") if os.path.exists(path + suffix)]
+        try:
+            if time.time() - max(os.path.getmtime(p) for p in paths) < EMPTY_PROJECT_MAX_AGE:
+                continue
+            if is_empty_project(path):
+                for p in paths:
+                    os.remove(p)
+        except (OSError, ValueError):  # progetto eliminato nel frattempo da un'altra sessione
+            continue
+
+def adopt_legacy_projects():
+    """Sposta in PROJECTS_DIR i progetti non vuoti rimasti nella vecchia cartella temporanea."""
+    if not os.path.isdir(LEGACY_PROJECTS_DIR) or os.path.abspath(LEGACY_PROJECTS_DIR) == os.path.abspath(PROJECTS_DIR):
+        return
+    os.makedirs(PROJECTS_DIR, exist_ok=True)
+    for file_name in os.listdir(LEGACY_PROJECTS_DIR):
+        source = os.path.join(LEGACY_PROJECTS_DIR, file_name)
+        target = os.path.join(PROJECTS_DIR, file_name)
+        if not file_name.endswith(".sqlite") or os.path.exists(target) or is_empty_project(source):
+            continue
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(source + suffix):
+                shutil.move(source + suffix, target + suffix)
+
+def open_project(name):
+    """Apre (o crea) il progetto su disco con il nome dato."""
+    os.makedirs(PROJECTS_DIR, exist_ok=True)
+    return ProjectStore(project_path(name))
+
+def switch_project(name):
+    """Apre il progetto dato al posto di quello della sessione (anche lo stesso, per ricaricarlo).
+
+    Il nome resta nell'URL (?progetto=...), così un ricaricamento della pagina
+    riapre lo stesso progetto, e diventa il default delle nuove sessioni.
+    """
+    name = project_name_for(name)
+    if 'project' in st.session_state:
+        st.session_state.project.close()
+    st.session_state.project_name = name
+    st.session_state.project = open_project(name)
+    st.session_state.cards = st.session_state.project.cards
+    st.session_state.current_preview_index = 0
+    st.query_params["progetto"] = name
+    with open(LAST_PROJECT_FILE, "w", encoding="utf-8") as f:
+        f.write(name)
+
+def reload_stale_project():
+    """Ricarica il progetto modificato da un'altra sessione, scartando le modifiche non salvate."""
+    switch_project(st.session_state.project_name)
+    st.warning("⚠️ Il progetto è stato modificato in un'altra sessione ed è stato ricaricato: ripeti l'operazione")
+
+def near_duplicates():
+    """Gruppi di domande quasi duplicate del progetto, ricalcolati solo quando il progetto cambia.
+
+    Returns:
+        Lista di gruppi di card, come find_near_duplicates
+    """
+    key = (st.session_state.project_name, st.session_state.project.revision)
+    cached = st.session_state.get('near_duplicates')
+    if cached is None or cached[0] != key:
+        with st.spinner("Ricerca dei duplicati..."):
+            cached = (key, find_near_duplicates(st.session_state.cards))
+        st.session_state.near_duplicates = cached
+    return cached[1]
+
 # Inizializzazione dello stato della sessione
-if 'qa_dict' not in st.session_state:
-    st.session_state.qa_dict = {}
-if 'qa_dict_per_file' not in st.session_state:
-    st.session_state.qa_dict_per_file = {}
+# Le card vivono nel CardStore del progetto: anteprima, modifiche ed esportazioni lavorano sugli stessi oggetti.
+# Il progetto viene dall'URL (ricaricamento della pagina) o è l'ultimo usato; se più sessioni
+# aprono lo stesso progetto, quella rimasta indietro viene fermata prima di scrivere (StaleProjectError)
+if 'project' not in st.session_state:
+    initial_project = project_name_for(st.query_params.get("progetto") or last_project())
+    adopt_legacy_projects()
+    prune_empty_projects(keep=initial_project)
+    switch_project(initial_project)
 if 'current_preview_index' not in st.session_state:
     st.session_state.current_preview_index = 0
 if 'theme' not in st.session_state:
@@ -194,6 +326,20 @@ st.markdown('<h1 class="main-header">🎯 Flashcard Creator</h1>', unsafe_allow_
 with st.sidebar:
     st.header("⚙️ Configurazioni")
     
+    # Progetto: card e modifiche vengono salvate su disco e ritrovate alla riapertura
+    st.subheader("📂 Progetto")
+    projects = list_projects()
+    if st.session_state.project_name not in projects:
+        projects.append(st.session_state.project_name)
+    selected_project = st.selectbox("Progetto aperto", projects, index=projects.index(st.session_state.project_name))
+    if selected_project != st.session_state.project_name:
+        switch_project(selected_project)
+        st.rerun()
+    new_project = st.text_input("Nuovo progetto", placeholder="Nome del nuovo progetto")
+    if st.button("➕ Crea progetto") and new_project.strip():
+        switch_project(new_project)
+        st.rerun()
+    
     # Tema
     st.subheader("🎨 Personalizzazione Tema")
     
@@ -250,6 +396,14 @@ with col1:
         help="Seleziona uno o più file Markdown contenenti domande e risposte"
     )
     
+    # Le immagini ![](percorso) degli appunti vengono cercate per nome tra questi file
+    uploaded_images = st.file_uploader(
+        "Carica le immagini usate negli appunti (opzionale)",
+        type=['png', 'jpg', 'jpeg', 'gif', 'webp', 'svg'],
+        accept_multiple_files=True,
+        help="Le immagini referenziate con ![](percorso) vengono incluse nel mazzo"
+    )
+    
     if uploaded_files:
         st.success(f"✅ {len(uploaded_files)} file caricati")
         
@@ -259,31 +413,38 @@ with col1:
         
         if st.button("🔄 Elabora File", type="primary"):
             with st.spinner("Elaborazione file in corso..."):
-                st.session_state.qa_dict = {}
-                st.session_state.qa_dict_per_file = {}
-                
-                for file in uploaded_files:
-                    content = file.read().decode('utf-8')
-                    qa_dict_temp = extract_qa_from_markdown(content)
-                    
-                    if qa_dict_temp:
-                        st.session_state.qa_dict_per_file[file.name] = qa_dict_temp
-                        st.session_state.qa_dict.update(qa_dict_temp)
-                
-                st.session_state.current_preview_index = 0
-                
-                if st.session_state.qa_dict:
-                    st.success(f"✅ Elaborate {len(st.session_state.qa_dict)} domande e risposte totali")
+                # Vengono rielaborati solo i file nuovi o modificati, e di questi solo i
+                # blocchi cambiati; le altre card restano quelle del progetto, con le loro modifiche
+                project = st.session_state.project
+                fingerprints, reparsed = extract_cards_incremental(
+                    [(file.name, file.getvalue()) for file in uploaded_files],
+                    project.fingerprints,
+                    project.cards,
+                    cache=render_cache
+                )
+                render_cache.flush()
+                try:
+                    project.save_extraction(fingerprints, reparsed)
+                except StaleProjectError:
+                    reload_stale_project()
                 else:
-                    st.warning("⚠️ Nessuna domanda e risposta trovata nei file")
+                    st.caption(f"🔁 File rielaborati: {len(reparsed)} su {len(uploaded_files)}")
+                    st.session_state.current_preview_index = 0
+                    
+                    if len(st.session_state.cards):
+                        st.success(f"✅ Elaborate {len(st.session_state.cards)} domande e risposte totali")
+                    else:
+                        st.warning("⚠️ Nessuna domanda e risposta trovata nei file")
 
 with col2:
     st.markdown('<h2 class="section-header">📊 Statistiche</h2>', unsafe_allow_html=True)
     
-    if st.session_state.qa_dict:
-        total_questions = len(st.session_state.qa_dict)
-        empty_answers = sum(1 for answer in st.session_state.qa_dict.values() if not answer)
-        files_count = len(st.session_state.qa_dict_per_file)
+    if len(st.session_state.cards):
+        # Conteggi dal database: non serve caricare i campi di tutte le card
+        project_stats = st.session_state.project.stats()
+        total_questions = project_stats['cards']
+        empty_answers = project_stats['empty_answers']
+        files_count = project_stats['files']
         
         st.markdown(f"""
         <div class="stats-container">
@@ -294,13 +455,43 @@ with col2:
             <p><strong>📁 File elaborati:</strong> {files_count}</p>
         </div>
         """, unsafe_allow_html=True)
+        
+        cache_stats = render_cache.stats()
+        st.caption(
+            f"♻️ Cache rendering: {cache_stats['hits']} hit, {cache_stats['misses']} miss, "
+            f"{cache_stats['memory_evictions'] + cache_stats['disk_evictions']} evizioni"
+        )
     else:
         st.info("📊 Carica alcuni file per vedere le statistiche")
 
 # Sezione anteprima e modifica
-if st.session_state.qa_dict:
+if len(st.session_state.cards):
     st.markdown('<h2 class="section-header">👀 Anteprima e Modifica</h2>', unsafe_allow_html=True)
     
+    # Ricerca full-text nel progetto: un clic su un risultato porta l'anteprima alla card
+    if st.session_state.project.searchable:
+        search_col, filter_col = st.columns([3, 1])
+        with search_col:
+            search_text = st.text_input(
+                "🔍 Cerca nelle card",
+                help='Tutte le parole devono comparire; "tra virgolette" cerca la frase esatta, parol* cerca il prefisso'
+            )
+        with filter_col:
+            search_file = st.selectbox("File", ["Tutti i file"] + st.session_state.cards.files())
+        if search_text.strip():
+            results = st.session_state.project.search(
+                search_text,
+                file_name=None if search_file == "Tutti i file" else search_file,
+                limit=20
+            )
+            if results:
+                st.caption(f"{len(results)} risultati (al massimo 20, i più pertinenti per primi)")
+                for card_id, file_name, snippet in results:
+                    if st.button(f"📄 {file_name}: {snippet}", key=f"search_result_{card_id}"):
+                        st.session_state.current_preview_index = st.session_state.cards.position(card_id)
+            else:
+                st.caption("Nessuna card trovata")
+    
     # Controlli di navigazione
     col1, col2, col3 = st.columns([1, 2, 1])
     
@@ -309,17 +500,21 @@ if st.session_state.qa_dict:
             st.session_state.current_preview_index = max(0, st.session_state.current_preview_index - 1)
     
     with col2:
-        total = len(st.session_state.qa_dict)
+        total = len(st.session_state.cards)
         st.markdown(f"<div style='text-align: center; font-size: 1.2em; font-weight: bold;'>{st.session_state.current_preview_index + 1} / {total}</div>", unsafe_allow_html=True)
     
     with col3:
         if st.button("Successiva ➡️"):
-            st.session_state.current_preview_index = min(len(st.session_state.qa_dict) - 1, st.session_state.current_preview_index + 1)
+            st.session_state.current_preview_index = min(len(st.session_state.cards) - 1, st.session_state.current_preview_index + 1)
     
     # Mostra domanda e risposta corrente
-    if st.session_state.qa_dict:
-        items = list(st.session_state.qa_dict.items())
-        current_question, current_answer = items[st.session_state.current_preview_index]
+    if len(st.session_state.cards):
+        current_card = st.session_state.cards[st.session_state.current_preview_index]
+        current_question, current_answer = current_card.question, current_card.answer
+        location = f"📄 {current_card.file}, riga {current_card.line}"
+        if current_card.block is not None:
+            location += f", blocco {current_card.block + 1}"
+        st.caption(location)
         
         # Anteprima domanda
         st.markdown(f"""
@@ -339,79 +534,164 @@ if st.session_state.qa_dict:
         
         # Editor per modifiche
         with st.expander("✏️ Modifica questa domanda/risposta"):
+            edits = st.session_state.project.history(current_card.id)
+            if edits:
+                st.caption(f"🕘 Card modificata {len(edits)} volte (storico salvato nel progetto)")
             new_question = st.text_area("Modifica domanda:", value=current_question, height=100)
             new_answer = st.text_area("Modifica risposta:", value=current_answer, height=150)
             
             if st.button("💾 Salva Modifiche"):
                 if new_question.strip():
-                    # Rimuovi la vecchia domanda
-                    del st.session_state.qa_dict[current_question]
-                    # Aggiungi la nuova
-                    st.session_state.qa_dict[new_question] = new_answer
-                    st.success("✅ Modifiche salvate!")
-                    st.rerun()
+                    # Modifica sul posto: la card mantiene posizione, file e identificativo;
+                    # la versione precedente resta nello storico del progetto
+                    try:
+                        st.session_state.project.update_card(current_card.id, question=new_question, answer=new_answer)
+                    except StaleProjectError:
+                        reload_stale_project()
+                    else:
+                        st.success("✅ Modifiche salvate!")
+                        st.rerun()
                 else:
                     st.error("❌ La domanda non può essere vuota")
 
+    # Domande quasi uguali tra file diversi (spazi, grassetto, punteggiatura o poche lettere di differenza)
+    with st.expander("🧬 Domande quasi duplicate"):
+        if st.button("🔎 Cerca duplicati"):
+            clusters = near_duplicates()
+            if clusters:
+                st.write(f"{len(clusters)} gruppi, {sum(len(cluster) - 1 for cluster in clusters)} card in più")
+                for cluster in clusters[:50]:
+                    st.markdown("\n".join(
+                        f"- 📄 {card.file}, riga {card.line}: {card.raw_question}" for card in cluster
+                    ))
+                    st.markdown("---")
+            else:
+                st.success("✅ Nessuna domanda duplicata")
+
 # Sezione esportazione
-if st.session_state.qa_dict:
+if len(st.session_state.cards):
     st.markdown('<h2 class="section-header">📤 Esportazione</h2>', unsafe_allow_html=True)
     
     # Nome del mazzo
     deck_name = st.text_input("Nome del mazzo Anki:", value="Il Mio Mazzo Flashcard")
     
+    # Limiti per l'importazione su telefono: oltre questi il mazzo viene diviso in più pacchetti
+    with st.expander("📱 Limiti per pacchetto (AnkiDroid)"):
+        max_cards = st.number_input("Card massime per pacchetto (0 = nessun limite)", min_value=0, value=0, step=500)
+        max_size_mb = st.number_input("Dimensione massima per pacchetto in MB (0 = nessun limite)", min_value=0.0, value=0.0, step=5.0)
+    
+    # Il formato anki21b è più compatto ma richiede Anki 2.1.50+ (e zstandard)
+    package_format = st.radio(
+        "Formato del pacchetto Anki:",
+        PACKAGE_FORMATS,
+        format_func=lambda f: {"anki2": "Compatibile (tutte le versioni)", "anki21b": "Compresso zstd (Anki 2.1.50+)"}[f],
+        horizontal=True
+    )
+    prerender = st.checkbox(
+        "🧮 Pre-renderizza le formule (MathML: card offline, senza MathJax)",
+        help="Richiede latex2mathml; le formule non convertibili restano a MathJax"
+    )
+    lean = st.checkbox(
+        "🪶 Modello leggero (card più piccole e veloci su mobile)",
+        help="Il tema diventa CSS del modello, l'HTML viene minificato e MathJax si carica solo nelle card con formule"
+    )
+    dedup = st.checkbox(
+        "🧬 Unisci le domande quasi duplicate",
+        help="Di ogni gruppo di domande quasi uguali resta solo l'ultima, come per le domande identiche"
+    )
+    if dedup:
+        # Prima di esportare si vede quali card verranno tolte dal mazzo
+        dropped = dropped_cards(near_duplicates())
+        if dropped:
+            with st.expander(f"🗑️ {len(dropped)} card verranno escluse dall'esportazione"):
+                st.markdown("\n".join(
+                    f"- 📄 {card.file}, riga {card.line}: {card.raw_question} (resta 📄 {kept.file}, riga {kept.line})"
+                    for card, kept in dropped[:200]
+                ))
+                if len(dropped) > 200:
+                    st.caption(f"... e altre {len(dropped) - 200}")
+        else:
+            st.caption("Nessuna domanda quasi duplicata da unire")
+    
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
         if st.button("📚 Esporta Anki (.apkg)", type="primary"):
             try:
-                with st.spinner("Creazione mazzo Anki..."):
+                with st.spinner("Creazione mazzo Anki..."), tempfile.TemporaryDirectory() as media_dir:
+                    # Immagini caricate: deduplicate per contenuto e aggiunte al pacchetto
+                    cards = st.session_state.cards
+                    if dedup:
+                        cards = merge_near_duplicates(cards, near_duplicates())
+                    media_files = []
+                    if uploaded_images:
+                        images_dir = os.path.join(media_dir, "caricate")
+                        os.makedirs(images_dir)
+                        for image in uploaded_images:
+                            with open(os.path.join(images_dir, os.path.basename(image.name)), "wb") as f:
+                                f.write(image.getvalue())
+                        # Gli appunti caricati possono riferirsi solo alle immagini caricate,
+                        # cercate per nome: mai a file del server
+                        collector = MediaCollector({}, media_dir, fallback_dir=images_dir, root_dir=images_dir)
+                        cards = cards.map_fields(collector.rewrite)
+                        media_files = collector.write()
+                        if collector.missing:
+                            st.warning("⚠️ Immagini non trovate: " + ", ".join(sorted({src for _, src in collector.missing})))
+                    
+                    mathjax = True
+                    if prerender:
+                        cards, mathjax = get_math_renderer().render_cards(cards)
+                        if mathjax:
+                            st.warning("⚠️ Alcune formule non sono convertibili: le card mantengono MathJax")
+                    
                     anki_package = create_anki_deck(
-                        st.session_state.qa_dict,
+                        None,
                         deck_name=deck_name,
                         theme=st.session_state.theme,
-                        qa_dict_per_file=st.session_state.qa_dict_per_file
+                        media_files=media_files,
+                        mathjax=mathjax,
+                        lean=lean,
+                        cards=cards
                     )
                     
-                    # Salva direttamente in un buffer senza file temporaneo
-                    buffer = BytesIO()
-                    
-                    # Crea un file temporaneo con un nome unico
-                    import uuid
-                    temp_filename = f"temp_anki_{uuid.uuid4().hex}.apkg"
-                    temp_path = os.path.join(tempfile.gettempdir(), temp_filename)
-                    
-                    try:
-                        # Scrivi il file temporaneo
-                        anki_package.write_to_file(temp_path)
-                        
-                        # Leggi il contenuto e copialo nel buffer
-                        with open(temp_path, 'rb') as f:
-                            buffer.write(f.read())
-                        
-                        # Elimina immediatamente il file temporaneo
-                        if os.path.exists(temp_path):
-                            os.remove(temp_path)
-                            
-                    except Exception as temp_error:
-                        # Se c'è un errore, assicurati che il file temporaneo sia eliminato
-                        if os.path.exists(temp_path):
-                            try:
-                                os.remove(temp_path)
-                            except:
-                                pass
-                        raise temp_error
+                    shards = shard_package(
+                        anki_package,
+                        max_cards=max_cards or None,
+                        max_bytes=int(max_size_mb * 1024 * 1024) or None
+                    )
                     
+                    # Il pacchetto viene scritto direttamente in memoria, senza file temporanei
+                    buffer = BytesIO()
+                    if len(shards) == 1:
+                        write_package_to_stream(anki_package, buffer, package_format=package_format)
+                        file_name = f"{deck_name}.apkg"
+                        mime = "application/octet-stream"
+                    else:
+                        # Più pacchetti: un unico zip con i .apkg e l'indice
+                        file_names = shard_file_names(f"{deck_name}.apkg", len(shards))
+                        with zipfile.ZipFile(buffer, 'w') as shards_zip:
+                            for shard, shard_name in zip(shards, file_names):
+                                with shards_zip.open(shard_name, 'w') as shard_file:
+                                    write_package_to_stream(shard, shard_file, package_format=package_format)
+                            shards_zip.writestr(
+                                f"{deck_name}.shards.json",
+                                json.dumps(shard_index(shards, file_names), ensure_ascii=False, indent=1)
+                            )
+                        file_name = f"{deck_name}.zip"
+                        mime = "application/zip"
                     buffer.seek(0)
                     
                     st.download_button(
                         label="📥 Scarica Mazzo Anki",
-                        data=buffer.getvalue(),
-                        file_name=f"{deck_name}.apkg",
-                        mime="application/octet-stream"
+                        data=buffer,
+                        file_name=file_name,
+                        mime=mime
                     )
                     
-                    st.success("✅ Mazzo Anki creato! Clicca per scaricare.")
+                    if len(shards) == 1:
+                        st.success("✅ Mazzo Anki creato! Clicca per scaricare.")
+                    else:
+                        st.success(f"✅ Mazzo diviso in {len(shards)} pacchetti (in un unico zip): importali in qualsiasi ordine.")
             except Exception as e:
                 st.error(f"❌ Errore nella creazione del mazzo: {str(e)}")
     
@@ -419,7 +699,7 @@ if st.session_state.qa_dict:
         if st.button("📊 Esporta CSV"):
             try:
                 # Crea DataFrame
-                df = pd.DataFrame(list(st.session_state.qa_dict.items()), columns=['Domanda', 'Risposta'])
+                df = pd.DataFrame(list(st.session_state.cards.qa_dict().items()), columns=['Domanda', 'Risposta'])
                 csv = df.to_csv(index=False)
                 
                 st.download_button(
@@ -436,7 +716,7 @@ if st.session_state.qa_dict:
         if st.button("🔧 Esporta XML"):
             try:
                 root = ET.Element("flashcards")
-                for domanda, risposta in st.session_state.qa_dict.items():
+                for domanda, risposta in st.session_state.cards.qa_dict().items():
                     card = ET.SubElement(root, "card")
                     q = ET.SubElement(card, "question")
                     q.text = domanda
@@ -458,7 +738,7 @@ if st.session_state.qa_dict:
     with col4:
         if st.button("🗂️ Esporta JSON"):
             try:
-                json_str = json.dumps(st.session_state.qa_dict, ensure_ascii=False, indent=2)
+                json_str = json.dumps(st.session_state.cards.qa_dict(), ensure_ascii=False, indent=2)
                 
                 st.download_button(
                     label="📥 Scarica JSON",
@@ -0,0 +1,67 @@
+"""Verifica di compatibilità del rendering contro un corpus di output attesi.
+
+Il file markdown_formatting.json contiene, per ogni funzione pubblica di
+qa_extractor, una lista di casi {"input": ..., "expected": ...} registrati
+con l'implementazione di riferimento. Qualsiasi riscrittura del renderer deve
+riprodurre gli stessi output byte per byte.
+
+Uso:
+    python golden/check_golden.py           # verifica
+    python golden/check_golden.py --update  # rigenera gli output attesi
+"""
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import qa_extractor
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "markdown_formatting.json")
+
+
+def run_case(function_name, value):
+    """Esegue la funzione indicata e restituisce un output serializzabile in JSON."""
+    result = getattr(qa_extractor, function_name)(value)
+    if isinstance(result, dict):
+        return [list(item) for item in result.items()]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--update", action="store_true", help="riscrive gli output attesi con quelli correnti")
+    args = parser.parse_args()
+
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    failures = 0
+    total = 0
+    for function_name, cases in corpus.items():
+        for case in cases:
+            total += 1
+            output = run_case(function_name, case["input"])
+            if args.update:
+                case["expected"] = output
+            elif output != case["expected"]:
+                failures += 1
+                print(f"DIFF {function_name}: {case['input']!r}")
+                print(f"  atteso:  {case['expected']!r}")
+                print(f"  ottenuto: {output!r}")
+
+    if args.update:
+        with open(CORPUS_PATH, "w", encoding="utf-8") as f:
+            json.dump(corpus, f, ensure_ascii=False, indent=1)
+            f.write("\n")
+        print(f"Aggiornati {total} casi")
+        return 0
+
+    print(f"{total - failures}/{total} casi invariati")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
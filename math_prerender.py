@@ -0,0 +1,121 @@
+"""Pre-rendering delle formule in fase di build.
+
+Le formule \\(...\\) prodotte da transform_math_formulas vengono convertite in
+MathML statico, che Anki (desktop, AnkiDroid, AnkiMobile) mostra senza
+scaricare MathJax: le card funzionano offline e non ricompongono le formule a
+ogni visualizzazione. La conversione usa latex2mathml, se installato, oppure
+una funzione fornita dal chiamante.
+"""
+import html
+import re
+
+try:
+    from latex2mathml.converter import convert as latex_to_mathml
+except ImportError:  # latex2mathml non installato: serve un renderer esplicito
+    latex_to_mathml = None
+
+# Le formule nel codice inline o a blocchi restano testo
+_FORMULA_RE = re.compile(r'(<pre>.*?</pre>|<code>.*?</code>)|\\\\\((.+?)\\\\\)', re.DOTALL)
+# Formula pre-renderizzata: il LaTeX originale (escapato) resta nell'attributo data-tex
+_RENDERED_RE = re.compile(r'<span class="math" data-tex="([^"]*)">.*?</span>', re.DOTALL)
+
+
+def restore_latex(text):
+    """Riporta le formule pre-renderizzate alla forma \\(...\\) da cui sono state prodotte.
+
+    Serve a chi deriva identità dal testo delle card (es. i GUID in
+    anki_deck_creator.question_key), che così non cambiano attivando il
+    pre-rendering.
+    """
+    if '<span class="math"' not in text:
+        return text
+    return _RENDERED_RE.sub(lambda match: '\\\\(' + match.group(1).replace('&quot;', '"') + '\\\\)', text)
+
+
+class MathPrerenderer:
+    """Converte le formule delle card in HTML statico, con una cache per formula.
+
+    Ogni formula distinta viene convertita una sola volta, anche se compare
+    in centinaia di card o in più build della stessa sessione (es. watch).
+    Le formule che non si riescono a convertire restano \\(...\\) e
+    richiedono quindi MathJax nel template.
+
+    Args:
+        render: Funzione LaTeX -> HTML; default latex2mathml (MathML)
+    """
+
+    COUNTERS = ('hits', 'misses', 'failures')
+
+    def __init__(self, render=None):
+        if render is None:
+            if latex_to_mathml is None:
+                raise ImportError("Il pre-rendering delle formule richiede latex2mathml (pip install latex2mathml)")
+            render = latex_to_mathml
+        self.render = render
+        self._cache = {}
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def render_formula(self, latex):
+        """Restituisce l'HTML della formula (LaTeX non escapato) o None se non convertibile."""
+        if latex in self._cache:
+            self.hits += 1
+            return self._cache[latex]
+        self.misses += 1
+        try:
+            rendered = self.render(latex)
+        except Exception:
+            rendered = None
+        if rendered is None:
+            self.failures += 1
+        self._cache[latex] = rendered
+        return rendered
+
+    def render_field(self, text):
+        """Sostituisce le formule di un campo renderizzato.
+
+        Returns:
+            Tupla (testo, pending) con pending True se qualche formula è
+            rimasta da comporre con MathJax
+        """
+        if '\\\\(' not in text:
+            return text, False
+        pending = False
+
+        def replace(match):
+            nonlocal pending
+            protected, formula = match.groups()
+            if protected is not None:
+                return protected
+            # Un tag dentro la formula viene dalla formattazione markdown
+            # (es. * o __): il LaTeX originale non è più ricostruibile
+            rendered = None if '<' in formula else self.render_formula(html.unescape(formula))
+            if rendered is None:
+                pending = True
+                return match.group(0)
+            tex = formula.replace('"', '&quot;')
+            return f'<span class="math" data-tex="{tex}">{rendered}</span>'
+
+        return _FORMULA_RE.sub(replace, text), pending
+
+    def render_cards(self, cards):
+        """Applica render_field ai campi di un card_store.CardStore.
+
+        Returns:
+            Tupla (CardStore, pending) come render_field; l'archivio di
+            partenza resta invariato
+        """
+        pending = False
+
+        def render(file_name, text):
+            nonlocal pending
+            text, field_pending = self.render_field(text)
+            pending = pending or field_pending
+            return text
+
+        return cards.map_fields(render), pending
+
+    def stats(self):
+        """Contatori della cache: formule riusate, convertite e non convertibili."""
+        return {name: getattr(self, name) for name in self.COUNTERS}
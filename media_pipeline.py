@@ -0,0 +1,198 @@
+"""Fase media della pipeline: porta nelle card le immagini referenziate negli appunti.
+
+Dopo l'estrazione, i riferimenti markdown ![alt](percorso) presenti nelle
+card vengono risolti rispetto al file di origine, deduplicati per contenuto
+su tutti i file, eventualmente ridimensionati e ricompressi (se Pillow è
+installato) e sostituiti da <img src="...">. I file risultanti, con nome
+derivato dall'hash del contenuto, vanno aggiunti al pacchetto come media.
+"""
+import hashlib
+import html
+import io
+import os
+import re
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow non installato: le immagini vengono copiate senza modifiche
+    Image = None
+
+# Le immagini dentro codice inline o a blocchi restano testo
+_IMAGE_RE = re.compile(
+    r'(<pre>.*?</pre>|<code>.*?</code>)'
+    r'|!\[([^\]]*)\]\(\s*(?:&lt;(.+?)&gt;|([^)\s]+))(?:\s+"[^"]*")?\s*\)',
+    re.DOTALL
+)
+_EXTERNAL_RE = re.compile(r'^(?:[a-z][a-z0-9+.-]*:|//)', re.IGNORECASE)
+
+# Formati che Pillow può ridimensionare e risalvare senza perdere animazioni o vettori
+_RESIZABLE = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.webp': 'WEBP'}
+
+
+def _media_name(path, ext, settings):
+    """Nome del file media: hash del contenuto originale e delle impostazioni di elaborazione."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(settings).encode('utf-8'))
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest() + ext
+
+
+def process_image(data, ext, max_dimension=None, quality=85):
+    """Ridimensiona e ricomprime un'immagine, se possibile e conveniente.
+
+    Args:
+        data: Contenuto originale del file
+        ext: Estensione del file in minuscolo (es. ".png")
+        max_dimension: Lato massimo in pixel; None lascia le dimensioni invariate
+        quality: Qualità JPEG/WebP usata nella ricompressione
+
+    Returns:
+        I byte da salvare: quelli originali se Pillow manca, il formato non è
+        gestito o la ricompressione non riduce la dimensione
+    """
+    if Image is None or max_dimension is None or ext not in _RESIZABLE:
+        return data
+
+    with Image.open(io.BytesIO(data)) as image:
+        if max(image.size) <= max_dimension:
+            return data
+        image.thumbnail((max_dimension, max_dimension))
+        if _RESIZABLE[ext] == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, _RESIZABLE[ext], quality=quality, optimize=True)
+    processed = output.getvalue()
+    return processed if len(processed) < len(data) else data
+
+
+def _write_media(source, ext, path, max_dimension, quality):
+    """Elabora l'immagine source e la scrive in path, se non esiste già."""
+    if os.path.exists(path):
+        return path
+    with open(source, 'rb') as f:
+        data = f.read()
+    processed = process_image(data, ext, max_dimension, quality)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(processed)
+    os.replace(temp_path, path)
+    return path
+
+
+class MediaCollector:
+    """Riscrive i riferimenti alle immagini campo per campo e raccoglie i file da includere.
+
+    Ogni file viene letto una sola volta per percorso ed elaborato una sola
+    volta per contenuto, anche se centinaia di card lo usano. I file già
+    presenti in media_dir (stesso contenuto e impostazioni) vengono riusati
+    senza rielaborarli.
+
+    Args:
+        base_dirs: Dizionario {nome_file: cartella} rispetto a cui risolvere i
+            percorsi relativi di ogni file
+        media_dir: Cartella in cui salvare i media elaborati
+        jobs: Thread per l'elaborazione delle immagini (None: default di ThreadPoolExecutor)
+        max_dimension: Lato massimo delle immagini in pixel (None: nessun ridimensionamento)
+        quality: Qualità della ricompressione JPEG/WebP
+        fallback_dir: Cartella in cui cercare per nome le immagini assenti nel
+            percorso indicato (es. immagini caricate a parte dall'utente)
+        root_dir: Se indicata, le immagini vengono lette solo da questa
+            cartella: i percorsi relativi dei file senza base_dirs partono da
+            qui, i percorsi assoluti e quelli che escono dalla cartella (anche
+            tramite link simbolici) non vengono risolti. Da usare quando gli
+            appunti arrivano da utenti non fidati
+
+    Attributes:
+        missing: Riferimenti non trovati come tuple (nome_file, percorso)
+    """
+
+    def __init__(self, base_dirs, media_dir, jobs=None, max_dimension=None, quality=85, fallback_dir=None,
+                 root_dir=None):
+        self.base_dirs = base_dirs
+        self.media_dir = media_dir
+        self.jobs = jobs
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self.fallback_dir = fallback_dir
+        self.root_dir = os.path.realpath(root_dir) if root_dir is not None else None
+        self.settings = (max_dimension, quality) if Image is not None and max_dimension is not None else None
+        self.missing = []
+        self._names_by_path = {}
+        self._sources = {}  # nome media -> (percorso originale, estensione)
+
+    def _allowed(self, path):
+        """True se path può essere letto: sempre, oppure solo dentro root_dir se indicata."""
+        if self.root_dir is None:
+            return True
+        real_path = os.path.realpath(path)
+        return os.path.commonpath((real_path, self.root_dir)) == self.root_dir
+
+    def _locate(self, file_name, src):
+        """Percorso del file referenziato da src, None se non trovato o non consentito."""
+        candidates = []
+        if self.root_dir is None or not os.path.isabs(src):
+            base_dir = self.base_dirs.get(file_name, self.root_dir or '.')
+            candidates.append(os.path.normpath(os.path.join(base_dir, src)))
+        if self.fallback_dir is not None:
+            candidates.append(os.path.join(self.fallback_dir, os.path.basename(src)))
+        for path in candidates:
+            if os.path.isfile(path) and self._allowed(path):
+                return path
+        return None
+
+    def _resolve(self, file_name, src):
+        path = self._locate(file_name, urllib.parse.unquote(src))
+        if path is None:
+            return None
+        if path not in self._names_by_path:
+            ext = os.path.splitext(path)[1].lower()
+            try:
+                name = _media_name(path, ext, self.settings)
+            except OSError:
+                name = None
+            else:
+                self._sources.setdefault(name, (path, ext))
+            self._names_by_path[path] = name
+        return self._names_by_path[path]
+
+    def rewrite(self, file_name, text):
+        """Sostituisce i riferimenti ![alt](percorso) di un campo renderizzato con tag <img>."""
+        if '![' not in text:
+            return text
+
+        def replace(match):
+            protected, alt, bracketed, plain = match.groups()
+            if protected is not None:
+                return protected
+            alt = alt.replace('"', '&quot;')
+            src = html.unescape(bracketed if bracketed is not None else plain)
+            if _EXTERNAL_RE.match(src):
+                return f'<img src="{html.escape(src)}" alt="{alt}">'
+            name = self._resolve(file_name, src)
+            if name is None:
+                self.missing.append((file_name, src))
+                return match.group(0)
+            return f'<img src="{name}" alt="{alt}">'
+
+        return _IMAGE_RE.sub(replace, text)
+
+    def write(self):
+        """Elabora e salva in media_dir le immagini referenziate finora.
+
+        Returns:
+            Lista dei percorsi dei media da aggiungere al pacchetto
+        """
+        if not self._sources:
+            return []
+        os.makedirs(self.media_dir, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = [
+                pool.submit(_write_media, source, ext, os.path.join(self.media_dir, name),
+                            self.max_dimension, self.quality)
+                for name, (source, ext) in self._sources.items()
+            ]
+            return [future.result() for future in futures]
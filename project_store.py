@@ -0,0 +1,418 @@
+"""Progetto persistente su SQLite: file sorgente, card estratte e storico delle modifiche.
+
+Lo stato di lavoro dell'app (card estratte e modificate a mano) sopravvive
+al riavvio del server o al ricaricamento della pagina: riaprendo il progetto
+le card tornano disponibili senza ricaricare né rielaborare i file. All'apertura
+vengono letti solo identificativi, file e righe delle card; i campi vengono
+caricati a pagine quando servono (vedi card_store.CardStore), così anche un
+progetto da 100k card si apre in una frazione di secondo.
+
+Il progetto salva anche la mappa sorgente dei file (hash e posizione di ogni
+blocco, vedi card_store.CardStore.set_file): dopo la riapertura un file
+modificato viene rielaborato solo nei blocchi cambiati, e il salvataggio
+riscrive soltanto le card nuove o spostate.
+
+Più istanze possono aprire lo stesso progetto, ma ognuna tiene le card in
+memoria: il database conserva un numero di revisione, incrementato a ogni
+scrittura, e un'istanza che scrive partendo da una revisione superata viene
+fermata con StaleProjectError invece di cancellare il lavoro delle altre.
+
+Se SQLite include FTS5, il progetto mantiene anche un indice full-text del
+testo delle card, aggiornato a ogni estrazione e modifica (vedi search).
+"""
+import contextlib
+import html
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+import urllib.request
+
+from card_store import CardStore
+
+# Versione dello schema, salvata in PRAGMA user_version
+PROJECT_FORMAT = 2
+
+# Identificativi per query nel caricamento dei campi (sotto il limite di parametri di SQLite)
+_LOAD_BATCH = 900
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS files ('
+    ' name TEXT PRIMARY KEY,'
+    ' position INTEGER NOT NULL,'
+    ' fingerprint TEXT NOT NULL,'
+    ' blocks BLOB)',
+    'CREATE TABLE IF NOT EXISTS cards ('
+    ' id INTEGER PRIMARY KEY,'
+    ' file TEXT NOT NULL,'
+    ' position INTEGER NOT NULL,'
+    ' line INTEGER NOT NULL,'
+    ' raw_question TEXT NOT NULL,'
+    ' raw_answer TEXT NOT NULL,'
+    ' question TEXT NOT NULL,'
+    ' answer TEXT NOT NULL,'
+    ' block INTEGER,'
+    ' byte_offset INTEGER,'
+    ' block_hash BLOB)',
+    # Copre la lettura dei metadati all'apertura senza toccare i campi
+    'CREATE INDEX IF NOT EXISTS cards_source ON cards (file, position, line, block, byte_offset, block_hash)',
+    'CREATE TABLE IF NOT EXISTS edits ('
+    ' seq INTEGER PRIMARY KEY,'
+    ' card_id INTEGER NOT NULL,'
+    ' time REAL NOT NULL,'
+    ' old_question TEXT NOT NULL,'
+    ' old_answer TEXT NOT NULL,'
+    ' new_question TEXT NOT NULL,'
+    ' new_answer TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS edits_card ON edits (card_id)',
+    'CREATE TABLE IF NOT EXISTS revision (value INTEGER NOT NULL)',
+    'INSERT INTO revision (value) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM revision)',
+)
+
+# Aggiornamento dei progetti salvati con una versione precedente dello schema
+_MIGRATIONS = {
+    1: (
+        'ALTER TABLE files ADD COLUMN blocks BLOB',
+        'ALTER TABLE cards ADD COLUMN block INTEGER',
+        'ALTER TABLE cards ADD COLUMN byte_offset INTEGER',
+        'ALTER TABLE cards ADD COLUMN block_hash BLOB',
+        'DROP INDEX IF EXISTS cards_file',
+    ),
+}
+
+# Un blocco nell'indice salvato: hash, riga e offset
+_BLOCK_ENTRY = struct.Struct('<16sQQ')
+
+# Indice full-text: testo delle card senza tag, accenti ignorati, indici per i prefissi brevi
+_FTS_SCHEMA = (
+    'CREATE VIRTUAL TABLE cards_fts USING fts5('
+    'file UNINDEXED, question, answer, '
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+)
+_FTS_INSERT = (
+    'INSERT INTO cards_fts (rowid, file, question, answer)'
+    ' SELECT id, file, search_text(question), search_text(answer) FROM cards'
+)
+
+_TAG_RE = re.compile(r'<[^>]*>')
+# Frase tra virgolette oppure parola, eventualmente con * finale per la ricerca per prefisso
+_QUERY_TERM_RE = re.compile(r'"([^"]*)"?|(\S+)')
+
+
+class StaleProjectError(Exception):
+    """Il progetto è stato modificato da un'altra istanza dopo l'apertura di questa."""
+
+
+def _search_text(field):
+    """Testo indicizzato di un campo renderizzato: tag sostituiti da spazi ed entità decodificate."""
+    return html.unescape(_TAG_RE.sub(' ', field))
+
+
+def _pack_block_index(block_index):
+    """Serializza l'indice dei blocchi di CardStore.source_index (None resta None)."""
+    if block_index is None:
+        return None
+    return b''.join(_BLOCK_ENTRY.pack(*entry) for entry in block_index)
+
+
+def _unpack_block_index(data):
+    if data is None:
+        return None
+    return list(_BLOCK_ENTRY.iter_unpack(data))
+
+
+def fts_query(text):
+    """Traduce una ricerca dell'utente in una query FTS5 sicura.
+
+    Le parole vengono cercate tutte (AND); "più parole" tra virgolette
+    cercano la frase esatta e una parola che termina con * cerca il prefisso.
+    Gli altri caratteri speciali di FTS5 vengono trattati come testo.
+
+    Returns:
+        La query FTS5, vuota se il testo non contiene termini
+    """
+    terms = []
+    for phrase, word in _QUERY_TERM_RE.findall(text):
+        if phrase.strip():
+            terms.append(f'"{phrase}"')
+        elif word:
+            prefix = word.endswith('*')
+            word = word.rstrip('*').replace('"', '')
+            if word:
+                terms.append(f'"{word}"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def is_empty_project(db_path):
+    """True se il progetto non ha né file né modifiche, e si può eliminare senza perdere lavoro.
+
+    Il database viene letto in sola lettura, senza crearlo né aggiornarne lo
+    schema; un file che non si riesce a leggere non viene considerato vuoto.
+    """
+    uri = 'file:' + urllib.request.pathname2url(os.path.abspath(db_path)) + '?mode=ro'
+    try:
+        db = sqlite3.connect(uri, uri=True)
+    except sqlite3.Error:
+        return False
+    try:
+        tables = {name for (name,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if not tables:
+            return True
+        if not {'files', 'edits'} <= tables:
+            return False
+        return not db.execute('SELECT EXISTS (SELECT 1 FROM files) OR EXISTS (SELECT 1 FROM edits)').fetchone()[0]
+    except sqlite3.Error:
+        return False
+    finally:
+        db.close()
+
+
+class ProjectStore:
+    """Progetto aperto: le card in un CardStore pigro e le impronte dei file sorgente.
+
+    Le scritture avvengono in transazioni raggruppate: un'estrazione salva
+    tutti i file rielaborati in una sola transazione, una modifica salva la
+    card e la sua voce di storico insieme.
+
+    Args:
+        db_path: Percorso del database del progetto (creato se non esiste)
+
+    Attributes:
+        cards: card_store.CardStore con le card del progetto
+        fingerprints: Impronte dei file sorgente (nome -> impronta) nell'ordine
+            di caricamento, da passare a qa_extractor.extract_cards_incremental
+        searchable: True se l'indice full-text (FTS5) è disponibile
+        revision: Revisione del database su cui si basano le card in memoria
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, PROJECT_FORMAT) and version not in _MIGRATIONS:
+            self._db.close()
+            raise ValueError(f"Formato di progetto non supportato: {version}")
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.create_function('search_text', 1, _search_text, deterministic=True)
+        with self._db:
+            for statement in _MIGRATIONS.get(version, ()):
+                self._db.execute(statement)
+            for statement in _SCHEMA:
+                self._db.execute(statement)
+            self._db.execute(f'PRAGMA user_version = {PROJECT_FORMAT}')
+            self.searchable = self._open_search_index()
+        # Letta prima dei dati: una scrittura concorrente durante l'apertura rende questa istanza superata
+        self.revision = self._db.execute('SELECT value FROM revision').fetchone()[0]
+        self.fingerprints = dict(self._db.execute('SELECT name, fingerprint FROM files ORDER BY position'))
+        self.cards = self._open_cards()
+
+    @contextlib.contextmanager
+    def _write(self):
+        """Transazione di scrittura che parte dalla revisione di questa istanza e la incrementa.
+
+        Raises:
+            StaleProjectError: Se un'altra istanza ha scritto nel progetto dopo
+                l'apertura: le card in memoria non sono più quelle salvate
+        """
+        with self._lock, self._db:
+            # Il lock di scrittura viene preso subito: nessuno può scrivere tra controllo e aggiornamento
+            self._db.execute('BEGIN IMMEDIATE')
+            revision = self._db.execute('SELECT value FROM revision').fetchone()[0]
+            if revision != self.revision:
+                raise StaleProjectError(
+                    f"Il progetto {self.db_path} è stato modificato da un'altra sessione: va riaperto"
+                )
+            yield
+            self._db.execute('UPDATE revision SET value = ?', (revision + 1,))
+        self.revision = revision + 1
+
+    def _open_search_index(self):
+        """Crea l'indice full-text se manca, indicizzando le card già salvate."""
+        if self._db.execute("SELECT 1 FROM sqlite_master WHERE name = 'cards_fts'").fetchone():
+            return True
+        try:
+            self._db.execute(_FTS_SCHEMA)
+        except sqlite3.OperationalError:  # SQLite compilato senza FTS5: niente ricerca
+            return False
+        self._db.execute(_FTS_INSERT)
+        return True
+
+    def _open_cards(self):
+        """Legge i metadati delle card; i campi restano su disco fino al primo uso."""
+        # Gli identificativi delle card rimosse con uno storico non vengono riusati
+        next_id = self._db.execute(
+            'SELECT MAX(COALESCE((SELECT MAX(id) FROM cards), 0), COALESCE((SELECT MAX(card_id) FROM edits), 0))'
+        ).fetchone()[0] + 1
+        cards = CardStore(fields_loader=self._load_fields, next_id=next_id)
+        for file_name, blocks in self._db.execute('SELECT name, blocks FROM files ORDER BY position').fetchall():
+            cards.add_lazy_file(file_name, self._db.execute(
+                'SELECT id, line, block, byte_offset, block_hash FROM cards WHERE file = ? ORDER BY position', (file_name,)
+            ), _unpack_block_index(blocks))
+        return cards
+
+    def _load_fields(self, card_ids):
+        fields = {}
+        with self._lock:
+            for start in range(0, len(card_ids), _LOAD_BATCH):
+                batch = card_ids[start:start + _LOAD_BATCH]
+                placeholders = ','.join('?' * len(batch))
+                for card_id, *values in self._db.execute(
+                    f'SELECT id, raw_question, raw_answer, question, answer FROM cards WHERE id IN ({placeholders})',
+                    batch
+                ):
+                    fields[card_id] = tuple(values)
+        return fields
+
+    def save_extraction(self, fingerprints, reparsed):
+        """Salva l'esito di extract_cards_incremental su self.cards in una sola transazione.
+
+        Args:
+            fingerprints: Nuove impronte dei file, nell'ordine di caricamento
+            reparsed: Nomi dei file rielaborati, le cui card vengono aggiornate
+
+        Raises:
+            StaleProjectError: Vedi _write; il database resta invariato
+        """
+        with self._write():
+            stored = {name for (name,) in self._db.execute('SELECT name FROM files')}
+            removed = [(name,) for name in stored - set(fingerprints)]
+            if self.searchable:
+                self._db.executemany('DELETE FROM cards_fts WHERE rowid IN (SELECT id FROM cards WHERE file = ?)', removed)
+            self._db.executemany('DELETE FROM cards WHERE file = ?', removed)
+            self._db.executemany('DELETE FROM files WHERE name = ?', removed)
+            for file_name in reparsed:
+                self._save_file_cards(file_name)
+            self._db.executemany(
+                'INSERT INTO files (name, position, fingerprint) VALUES (?, ?, ?)'
+                ' ON CONFLICT (name) DO UPDATE SET position = excluded.position, fingerprint = excluded.fingerprint',
+                [(name, position, fingerprint) for position, (name, fingerprint) in enumerate(fingerprints.items())]
+            )
+            self._db.executemany(
+                'UPDATE files SET blocks = ? WHERE name = ?',
+                [(_pack_block_index(self.cards.source_index(name)), name) for name in reparsed]
+            )
+        self.fingerprints = dict(fingerprints)
+
+    def _save_file_cards(self, file_name):
+        """Allinea le card salvate di un file rielaborato a quelle di self.cards.
+
+        Le card conservate da CardStore.set_file (blocchi invariati) hanno gli
+        stessi campi di prima: di queste si aggiornano solo posizione e mappa
+        sorgente, e solo se sono cambiate. Le card nuove vengono inserite e
+        quelle scomparse eliminate, insieme alle loro voci nell'indice full-text.
+        """
+        stored = {
+            card_id: tuple(source) for card_id, *source in self._db.execute(
+                'SELECT id, position, line, block, byte_offset, block_hash FROM cards WHERE file = ?', (file_name,)
+            )
+        }
+        cards = self.cards.cards_in_file(file_name)
+        inserted = []
+        moved = []
+        for position, card in enumerate(cards):
+            source = (position, card.line, card.block, card.offset, card.block_hash)
+            previous = stored.pop(card.id, None)
+            if previous is None:
+                inserted.append((card.id, file_name, *source, card.raw_question, card.raw_answer,
+                                 card.question, card.answer))
+            elif previous != source:
+                moved.append((*source, card.id))
+        deleted = [(card_id,) for card_id in stored]
+
+        if self.searchable:
+            self._db.executemany('DELETE FROM cards_fts WHERE rowid = ?', deleted)
+        self._db.executemany('DELETE FROM cards WHERE id = ?', deleted)
+        self._db.executemany(
+            'UPDATE cards SET position = ?, line = ?, block = ?, byte_offset = ?, block_hash = ? WHERE id = ?', moved
+        )
+        self._db.executemany(
+            'INSERT INTO cards (id, file, position, line, block, byte_offset, block_hash,'
+            ' raw_question, raw_answer, question, answer) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            inserted
+        )
+        if self.searchable:
+            if len(inserted) == len(cards):
+                # Nessuna card conservata (file nuovo o rielaborato per intero): una sola query
+                self._db.execute(_FTS_INSERT + ' WHERE file = ?', (file_name,))
+            else:
+                self._db.executemany(_FTS_INSERT + ' WHERE id = ?', [(row[0],) for row in inserted])
+
+    def update_card(self, card_id, question=None, answer=None):
+        """Modifica una card (vedi CardStore.update) e ne registra la versione precedente.
+
+        Returns:
+            La card modificata
+
+        Raises:
+            StaleProjectError: Vedi _write; la card resta invariata
+        """
+        card = self.cards.get(card_id)
+        old_question, old_answer = card.question, card.answer
+        with self._write():
+            self.cards.update(card_id, question=question, answer=answer)
+            self._db.execute(
+                'UPDATE cards SET question = ?, answer = ? WHERE id = ?', (card.question, card.answer, card_id)
+            )
+            self._db.execute(
+                'INSERT INTO edits (card_id, time, old_question, old_answer, new_question, new_answer)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (card_id, time.time(), old_question, old_answer, card.question, card.answer)
+            )
+            if self.searchable:
+                self._db.execute(
+                    'UPDATE cards_fts SET question = search_text(?), answer = search_text(?) WHERE rowid = ?',
+                    (card.question, card.answer, card_id)
+                )
+        return card
+
+    def search(self, text, file_name=None, limit=50):
+        """Cerca le card per testo, dalla più pertinente (vedi fts_query per la sintassi).
+
+        Args:
+            text: Testo cercato dall'utente
+            file_name: Se indicato, cerca solo tra le card di questo file
+            limit: Numero massimo di risultati
+
+        Returns:
+            Lista di tuple (id_card, nome_file, estratto) con i termini
+            trovati nell'estratto racchiusi tra **
+        """
+        query = fts_query(text)
+        if not self.searchable or not query:
+            return []
+        sql = "SELECT rowid, file, snippet(cards_fts, -1, '**', '**', '…', 12) FROM cards_fts WHERE cards_fts MATCH ?"
+        params = [query]
+        if file_name is not None:
+            sql += ' AND file = ?'
+            params.append(file_name)
+        sql += ' ORDER BY rank LIMIT ?'
+        params.append(limit)
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def history(self, card_id):
+        """Storico delle modifiche di una card, dalla più vecchia, come lista di dizionari."""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT time, old_question, old_answer, new_question, new_answer FROM edits'
+                ' WHERE card_id = ? ORDER BY seq', (card_id,)
+            ).fetchall()
+        keys = ('time', 'old_question', 'old_answer', 'new_question', 'new_answer')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def stats(self):
+        """Conteggi del progetto calcolati sul database, senza caricare i campi delle card."""
+        with self._lock:
+            cards, empty_answers = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(answer = ''), 0) FROM cards"
+            ).fetchone()
+            edits = self._db.execute('SELECT COUNT(*) FROM edits').fetchone()[0]
+        return {'cards': cards, 'files': len(self.cards.files()), 'empty_answers': empty_answers, 'edits': edits}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -1,4 +1,85 @@
+import bisect
+import codecs
+import hashlib
+import io
+import itertools
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+
+from card_store import CardStore
+
+# Separatore tra blocchi: una riga contenente solo --- (spazi ammessi attorno)
+_BLOCK_SEPARATOR_RE = re.compile(r'\n\s*---\s*\n')
+_SPACES_RE = re.compile(r'\s*')
+
+# Dimensione dei chunk letti dallo stream in iter_qa_from_stream
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Versione dell'output di render_field: va incrementata a ogni modifica che
+# cambia l'HTML prodotto, così le cache di rendering esistenti vengono ignorate
+RENDER_PIPELINE_VERSION = 1
+
+# Regole inline nell'ordine storico: ogni regola lavora sull'output della
+# precedente (es. il codice inline viene convertito dopo grassetto e corsivo),
+# quindi l'ordine fa parte del formato e non va cambiato.
+# Ogni regola è (carattere che la attiva, pattern, sostituzione).
+_INLINE_RULES = (
+    ('*', re.compile(r'\*\*(.+?)\*\*'), r'<b>\1</b>'),      # grassetto
+    ('*', re.compile(r'\*(.+?)\*'), r'<i>\1</i>'),          # corsivo
+    ('~', re.compile(r'~~(.+?)~~'), r'<s>\1</s>'),          # barrato
+    ('`', re.compile(r'`([^`]+)`'), r'<code>\1</code>'),    # codice inline
+    ('_', re.compile(r'__(.+?)__'), r'<u>\1</u>'),          # sottolineato
+    ('=', re.compile(r'==(.+?)=='), r'<mark>\1</mark>'),    # evidenziato
+)
+_INLINE_MARKERS = frozenset(trigger for trigger, _, _ in _INLINE_RULES)
+
+_ORDERED_ITEM_RE = re.compile(r'\d+\. ')
+
+
+def _list_kind(line):
+    """Restituisce 'ul', 'ol' o None a seconda che la riga sia un elemento di lista."""
+    stripped = line.strip()
+    if stripped.startswith('- '):
+        return 'ul'
+    if _ORDERED_ITEM_RE.match(stripped):
+        return 'ol'
+    return None
+
+
+def _render_list_item(line, kind, first, last):
+    """Converte una riga di lista, aprendo/chiudendo <ul>/<ol> a inizio/fine serie.
+
+    Il primo elemento di una serie riceve solo il tag di apertura e non
+    diventa <li>: è il comportamento storico e i mazzi esistenti lo riflettono.
+    """
+    closing = f'</{kind}>' if last else ''
+    if first:
+        return f'<{kind}>{line}{closing}'
+    if kind == 'ul':
+        if line.startswith('- '):
+            line = '<li>' + line[2:]
+    else:
+        match = _ORDERED_ITEM_RE.match(line)
+        if match:
+            line = '<li>' + line[match.end():]
+    return line + closing + '</li>'
+
+
+def _render_lists(text):
+    """Converte le liste puntate e numerate con una sola passata sulle righe."""
+    lines = text.split('\n')
+    kinds = [_list_kind(line) for line in lines]
+    kinds.append(None)
+
+    for i, kind in enumerate(kinds[:-1]):
+        if kind is not None:
+            first = i == 0 or kinds[i - 1] != kind
+            last = kinds[i + 1] != kind
+            lines[i] = _render_list_item(lines[i], kind, first, last)
+
+    return '\n'.join(lines)
+
 
 def transform_markdown_formatting(text):
     """Trasforma la formattazione markdown in HTML compatibile con Anki.
@@ -11,64 +92,74 @@ def transform_markdown_formatting(text):
     """
     if not text:
         return text
-        
-    # Converti grassetto (**testo** -> <b>testo</b>)
-    text = re.sub(r'\*\*(.+?)\*\*', r'<b>\1</b>', text)
-    
-    # Converti corsivo (*testo* -> <i>testo</i>)
-    text = re.sub(r'\*(.+?)\*', r'<i>\1</i>', text)
-    
-    # Converti testo barrato (~~testo~~ -> <s>testo</s>)
-    text = re.sub(r'~~(.+?)~~', r'<s>\1</s>', text)
-    
-    # Converti codice inline (`testo` -> <code>testo</code>)
-    text = re.sub(r'`([^`]+)`', r'<code>\1</code>', text)
-    
-    # Converti sottolineato (__testo__ -> <u>testo</u>)
-    text = re.sub(r'__(.+?)__', r'<u>\1</u>', text)
-    
-    # Converti testo evidenziato (==testo== -> <mark>testo</mark>)
-    text = re.sub(r'==(.+?)==', r'<mark>\1</mark>', text)
     
-    # Converti liste non ordinate
-    lines = text.split('\n')
-    in_list = False
-    for i, line in enumerate(lines):
-        if line.strip().startswith('- '):
-            if not in_list:
-                lines[i] = '<ul>' + line
-                in_list = True
-        elif in_list and not line.strip().startswith('- '):
-            lines[i-1] = lines[i-1] + '</ul>'
-            in_list = False
-    
-    if in_list:
-        lines[-1] = lines[-1] + '</ul>'
-    
-    # Converti liste ordinate
-    in_list = False
-    for i, line in enumerate(lines):
-        if re.match(r'^\d+\. ', line.strip()):
-            if not in_list:
-                lines[i] = '<ol>' + line
-                in_list = True
-        elif in_list and not re.match(r'^\d+\. ', line.strip()):
-            lines[i-1] = lines[i-1] + '</ol>'
-            in_list = False
+    # Una sola scansione per capire quali regole possono applicarsi:
+    # le altre vengono saltate senza ripassare il testo
+    markers = _INLINE_MARKERS.intersection(text)
+    if markers:
+        for trigger, pattern, replacement in _INLINE_RULES:
+            if trigger in markers:
+                text = pattern.sub(replacement, text)
     
-    if in_list:
-        lines[-1] = lines[-1] + '</ol>'
+    # Liste non ordinate (- ) e ordinate (1. ), con i relativi <li>
+    if '- ' in text or '. ' in text:
+        text = _render_lists(text)
     
-    # Converti elementi delle liste
-    for i, line in enumerate(lines):
-        if line.strip().startswith('- '):
-            lines[i] = re.sub(r'^- ', '<li>', line) + '</li>'
-        elif re.match(r'^\d+\. ', line.strip()):
-            lines[i] = re.sub(r'^\d+\. ', '<li>', line) + '</li>'
-    
-    text = '\n'.join(lines)
     return text
 
+# Regioni di codice in cui le formule $...$ non vanno convertite
+_CODE_SPAN_PATTERNS = (
+    re.compile(r'`([^`]+)`'),                          # codice inline
+    re.compile(r'<code[^>]*>.*?</code>', re.DOTALL),   # codice HTML già convertito
+    re.compile(r'```.*?```', re.DOTALL),               # blocchi di codice multilinea
+)
+_MATH_RE = re.compile(r'\$([^$]+)\$')
+
+# Tag HTML validi che l'escape deve preservare (es. <b>, <i>, ...). Nella stessa
+# passata ogni altro < o > viene escapato.
+_VALID_TAG = r'</?(?:b|i|u|s|code|mark|ul|ol|li|div|span|br|hr|p)(?:\s+[^>]*)?>'
+_ESCAPE_RE = re.compile(f'({_VALID_TAG})|[<>]')
+_HTML_ESCAPES = {'<': '&lt;', '>': '&gt;'}
+# Minificazione: il codice resta intatto, gli spazi attorno ai tag di blocco
+# spariscono, le altre sequenze di spazi diventano uno spazio
+_MINIFY_RE = re.compile(r'(<code>.*?</code>)|\s*(</?(?:ul|ol|li|div|p|br|hr)(?:\s+[^>]*)?>)\s*|\s+', re.DOTALL)
+
+
+class ProtectedSpans:
+    """Indice ordinato di regioni protette di un campo, con ricerca logaritmica.
+
+    Le regioni (intervalli semiaperti [start, end)) possono sovrapporsi: vengono
+    fuse in intervalli disgiunti, così la verifica di una posizione è una
+    ricerca binaria invece di una scansione di tutte le regioni.
+    """
+
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self, spans):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(spans):
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    @classmethod
+    def code_spans(cls, text):
+        """Costruisce l'indice delle regioni di codice (inline, <code> e ```) del testo."""
+        return cls(
+            match.span()
+            for pattern in _CODE_SPAN_PATTERNS
+            for match in pattern.finditer(text)
+        )
+
+    def __contains__(self, pos):
+        """Verifica se una posizione è all'interno di una regione protetta."""
+        i = bisect.bisect_right(self.starts, pos) - 1
+        return i >= 0 and pos < self.ends[i]
+
+
 def transform_math_formulas(text):
     """Trasforma le formule matematiche da $...$ a \\(...\\).
     
@@ -81,50 +172,20 @@ def transform_math_formulas(text):
     if not text:
         return text
     
-    # Pattern per trovare formule tra $ ma solo fuori dai blocchi di codice
-    def replace_math_outside_code(text):
-        # Trova tutti i blocchi di codice (inline e block)
-        code_blocks = []
-        
-        # Trova blocchi di codice inline (`code`)
-        for match in re.finditer(r'`([^`]+)`', text):
-            code_blocks.append((match.start(), match.end()))
-        
-        # Trova blocchi di codice HTML già convertiti (<code>...</code>)
-        for match in re.finditer(r'<code[^>]*>.*?</code>', text, re.DOTALL):
-            code_blocks.append((match.start(), match.end()))
-        
-        # Trova blocchi di codice multilinea (```...```)
-        for match in re.finditer(r'```.*?```', text, re.DOTALL):
-            code_blocks.append((match.start(), match.end()))
-        
-        # Ordina i blocchi di codice per posizione
-        code_blocks.sort()
-        
-        def is_inside_code_block(pos):
-            """Verifica se una posizione è all'interno di un blocco di codice"""
-            for start, end in code_blocks:
-                if start <= pos < end:
-                    return True
-            return False
+    # Applica la trasformazione delle formule matematiche PRIMA della formattazione markdown
+    if '$' in text:
+        code_spans = ProtectedSpans.code_spans(text)
         
         def replace_formula(match):
-            # Verifica se la formula è all'interno di un blocco di codice
-            if is_inside_code_block(match.start()):
-                return match.group(0)  # Non sostituire se è dentro un blocco di codice
-            formula = match.group(1)
-            return rf'\\({formula}\\)'
+            # Non sostituire se la formula è dentro un blocco di codice
+            if match.start() in code_spans:
+                return match.group(0)
+            return rf'\\({match.group(1)}\\)'
         
-        # Sostituisci le formule matematiche solo se non sono in blocchi di codice
-        return re.sub(r'\$([^$]+)\$', replace_formula, text)
-    
-    # Applica la trasformazione delle formule matematiche PRIMA della formattazione markdown
-    text_with_math = replace_math_outside_code(text)
+        text = _MATH_RE.sub(replace_formula, text)
     
     # Applica la formattazione markdown
-    result = transform_markdown_formatting(text_with_math)
-    
-    return result
+    return transform_markdown_formatting(text)
 
 def escape_anki_html(text):
     """
@@ -136,71 +197,512 @@ def escape_anki_html(text):
     Returns:
         Testo con i caratteri speciali HTML escapati
     """
-    if not text:
+    if not text or ('<' not in text and '>' not in text):
         return text
     
-    # Sostituisci i < e > che non fanno parte di un tag HTML valido
-    # Preserva i tag HTML validi come <b>, <i>, ecc.
-    valid_tags = r'</?(?:b|i|u|s|code|mark|ul|ol|li|div|span|br|hr|p)(?:\s+[^>]*)?>'
-    parts = re.split(f'({valid_tags})', text)
+    # Una sola passata: i tag HTML validi (come <b>, <i>, ecc.) restano intatti,
+    # i < e > fuori da un tag valido vengono escapati
+    return _ESCAPE_RE.sub(lambda match: match.group(1) or _HTML_ESCAPES[match.group(0)], text)
+
+def minify_html(text):
+    """Riduce l'HTML di un campo renderizzato senza cambiarne la resa.
     
-    for i in range(len(parts)):
-        # Se la parte non corrisponde a un tag HTML valido
-        if i % 2 == 0:  # parti alternate sono testo normale
-            # Escape di < e > che non fanno parte di tag HTML validi
-            parts[i] = re.sub(r'<', '&lt;', parts[i])
-            parts[i] = re.sub(r'>', '&gt;', parts[i])
+    Args:
+        text: HTML prodotto da render_field
+        
+    Returns:
+        HTML con gli spazi superflui rimossi
+    """
+    return _MINIFY_RE.sub(lambda match: match.group(1) or match.group(2) or ' ', text).strip()
+
+def render_field(text):
+    """Applica a un campo l'intera pipeline di rendering: formule, markdown ed escape HTML.
     
-    return ''.join(parts)
+    Args:
+        text: Testo markdown del campo (domanda o risposta)
+        
+    Returns:
+        HTML del campo pronto per Anki
+    """
+    return escape_anki_html(transform_math_formulas(text))
+
+# Marcatore "Domanda:" / "Risposta:" / "Risposta corretta:" (eventualmente in grassetto).
+# Il gruppo "pre" cattura il "**" iniziale opzionale: la sua fine coincide con
+# l'inizio degli spazi che precedono la parola chiave.
+_MARKER_RE = re.compile(
+    r'(?P<pre>(?:\*\*)?)\s*(?:(?P<domanda>Domanda)|Risposta(?:\s+corretta)?)\s*(?:\*\*)?\s*:',
+    re.IGNORECASE
+)
+
+# Spazi e "**" opzionale che seguono i due punti del marcatore
+_AFTER_MARKER_RE = re.compile(r'\s*(?:\*\*)?\s*')
+
+
+def _tokenize_block(block, starts=None):
+    """Scansiona un blocco una sola volta e restituisce i suoi segmenti.
+
+    Ogni segmento è una tupla (is_domanda, testo) con il testo che segue il
+    marcatore fino al marcatore successivo o alla fine del blocco, delimitato
+    esattamente come faceva la vecchia coppia di regex con lookahead pigro.
+
+    Args:
+        block: Blocco di testo già ripulito dagli spazi esterni
+        starts: Lista opzionale in cui aggiungere, per ogni segmento, la
+            posizione della parola "Domanda" nel blocco (-1 per le risposte)
+
+    Returns:
+        Lista di segmenti nell'ordine in cui compaiono nel blocco
+    """
+    markers = list(_MARKER_RE.finditer(block))
+    segments = []
+
+    for i, marker in enumerate(markers):
+        if starts is not None:
+            starts.append(marker.start('domanda'))
+        text_start = _AFTER_MARKER_RE.match(block, marker.end()).end()
+
+        if i + 1 < len(markers):
+            next_marker = markers[i + 1]
+            if text_start <= next_marker.start():
+                text_end = next_marker.start()
+            else:
+                # Il testo inizia dentro il prefisso del marcatore successivo
+                # ("**" o spazi): il lookahead può riagganciarsi solo dagli spazi
+                text_end = max(text_start, next_marker.end('pre'))
+        else:
+            text_end = len(block)
+
+        segments.append((marker.group('domanda') is not None, block[text_start:text_end].strip()))
+
+    return segments
+
+
+def _separator_tail_start(buffer, start):
+    """Restituisce l'inizio della coda del buffer fatta solo di spazi e trattini.
+
+    Un separatore non ancora completo può iniziare solo dentro questa coda,
+    quindi la ricerca successiva può ripartire da qui.
+    """
+    i = len(buffer)
+    while i > start and (buffer[i - 1].isspace() or buffer[i - 1] == '-'):
+        i -= 1
+    return i
+
+
+def _iter_blocks(chunks, with_positions=False):
+    """Divide un flusso di chunk di testo in blocchi separati da ---.
+
+    Produce esattamente gli stessi blocchi di re.split sul testo completo, ma
+    tiene in memoria solo il blocco corrente: un separatore viene accettato
+    quando gli spazi che lo seguono sono terminati, perché un chunk successivo
+    potrebbe ancora estenderlo.
+
+    Args:
+        chunks: Iterabile di stringhe da concatenare
+        with_positions: Se True produce tuple (riga, offset, blocco) con il
+            numero di riga (da 1) e l'offset in byte UTF-8 da cui inizia il
+            blocco
+
+    Yields:
+        I blocchi di testo, nell'ordine del contenuto
+    """
+    buffer = ''
+    block_start = 0
+    search_from = 0
+    line = 1
+    offset = 0
+    eof = False
+    chunks = iter(chunks)
+
+    while not eof:
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+        elif not chunk:
+            continue
+        elif block_start:
+            # Scarta la parte già emessa prima di accodare il nuovo chunk
+            buffer = buffer[block_start:] + chunk
+            search_from -= block_start
+            block_start = 0
+        else:
+            buffer += chunk
+
+        while True:
+            match = _BLOCK_SEPARATOR_RE.search(buffer, search_from)
+            if match is None:
+                search_from = max(search_from, _separator_tail_start(buffer, search_from))
+                break
+            if not eof and _SPACES_RE.match(buffer, match.end()).end() == len(buffer):
+                # Gli spazi dopo --- arrivano a fine buffer: il separatore
+                # potrebbe inglobare altre righe vuote del chunk successivo
+                search_from = match.start()
+                break
+            if with_positions:
+                yield line, offset, buffer[block_start:match.start()]
+                line += buffer.count('\n', block_start, match.end())
+                offset += len(buffer[block_start:match.end()].encode('utf-8'))
+            else:
+                yield buffer[block_start:match.start()]
+            block_start = search_from = match.end()
+
+    yield (line, offset, buffer[block_start:]) if with_positions else buffer[block_start:]
+
+
+def _pair_indexes(segments):
+    """Indici dei segmenti domanda seguiti da una risposta non vuota.
+
+    Ogni domanda viene associata alla risposta che la segue immediatamente:
+    una domanda seguita da un'altra domanda resta senza risposta.
+    """
+    return [
+        i for i, ((is_domanda, _), (next_is_domanda, risposta)) in enumerate(zip(segments, segments[1:]))
+        if is_domanda and not next_is_domanda and risposta
+    ]
+
+
+def _strip_asterisks(text):
+    """Rimuove gli asterischi di grassetto rimasti attorno a un campo."""
+    text = re.sub(r'^(\*\*)+\s*', '', text).strip()
+    return re.sub(r'\s*(\*\*)+$', '', text).strip()
+
+
+def _iter_block_pairs(segments):
+    """Associa i segmenti di un blocco in coppie (domanda, risposta) grezze."""
+    for i in _pair_indexes(segments):
+        yield _strip_asterisks(segments[i][1]), _strip_asterisks(segments[i + 1][1])
 
-def extract_qa_from_markdown(content):
-    """Estrae domande e risposte dal contenuto markdown."""
-    # Dividi il contenuto in blocchi usando il separatore ---
-    # Modifica per rendere lo split più robusto a spazi attorno a ---
-    blocks = re.split(r'\n\s*---\s*\n', content)
+
+def _iter_block_qa(block, cache=None):
+    """Estrae le coppie (domanda, risposta) già formattate da un singolo blocco.
+
+    Se cache è fornita (es. render_cache.RenderCache), il rendering di ogni
+    card passa da cache.render_card.
+    """
+    block = block.strip()
+    if not block:
+        return
     
-    qa_dict = {}
+    for domanda, risposta in _iter_block_pairs(_tokenize_block(block)):
+        # Applica trasformazioni ed escape HTML
+        if cache is not None:
+            yield cache.render_card(domanda, risposta)
+        else:
+            yield render_field(domanda), render_field(risposta)
+
+
+def _block_hash(block):
+    """Hash (16 byte) del testo di un blocco, che identifica i blocchi invariati."""
+    return hashlib.blake2b(block.encode('utf-8'), digest_size=16).digest()
+
+
+def _block_cards(block, cache=None):
+    """Come _iter_block_qa, ma restituisce anche posizione e campi grezzi di ogni card.
+
+    Args:
+        block: Blocco di testo non ripulito, come prodotto da _iter_blocks
+
+    Returns:
+        Lista di tuple (righe, byte, domanda_grezza, risposta_grezza, domanda,
+        risposta) dove righe e byte sono la distanza del marcatore "Domanda"
+        dall'inizio del blocco
+    """
+    stripped = block.strip()
+    if not stripped:
+        return []
+    lead = len(block) - len(block.lstrip())
+    line = block.count('\n', 0, lead)
+    offset = len(block[:lead].encode('utf-8'))
+
+    cards = []
+    starts = []
+    segments = _tokenize_block(stripped, starts)
+    counted_to = 0
+    for i in _pair_indexes(segments):
+        line += stripped.count('\n', counted_to, starts[i])
+        offset += len(stripped[counted_to:starts[i]].encode('utf-8'))
+        counted_to = starts[i]
+        raw_domanda = _strip_asterisks(segments[i][1])
+        raw_risposta = _strip_asterisks(segments[i + 1][1])
+        if cache is not None:
+            domanda, risposta = cache.render_card(raw_domanda, raw_risposta)
+        else:
+            domanda, risposta = render_field(raw_domanda), render_field(raw_risposta)
+        cards.append((line, offset, raw_domanda, raw_risposta, domanda, risposta))
+    return cards
+
+
+def _extract_blocks(chunks, cache=None, previous=None):
+    """Divide un file in blocchi e ne estrae le card, riusando i blocchi invariati.
+
+    Il risultato è la mappa sorgente del file: per ogni blocco, anche senza
+    card, l'hash del testo, la posizione nel file e le card con la loro
+    posizione relativa al blocco. Un blocco con lo stesso hash di un blocco di
+    previous riusa le sue card così come sono: riconoscimento dei marcatori e
+    rendering vengono rifatti solo per i blocchi nuovi o modificati, e le
+    posizioni relative restano valide anche se il blocco si è spostato.
+
+    Args:
+        chunks: Chunk di testo del file
+        cache: Cache di rendering opzionale (vedi extract_many)
+        previous: Mappa sorgente di un'estrazione precedente dello stesso file
+
+    Returns:
+        Lista di tuple (hash, riga, offset, card) nell'ordine del file, con
+        riga (da 1) e offset in byte dell'inizio del blocco e card come in
+        _block_cards
+    """
+    reusable = {}
+    for block_hash, _, _, cards in previous or ():
+        reusable.setdefault(block_hash, cards)
+
+    blocks = []
+    for line, offset, block in _iter_blocks(chunks, with_positions=True):
+        block_hash = _block_hash(block)
+        cards = reusable.get(block_hash)
+        if cards is None:
+            cards = _block_cards(block, cache)
+        blocks.append((block_hash, line, offset, cards))
+    return blocks
+
+
+def _iter_qa_from_chunks(chunks, cache=None):
+    """Estrae le coppie (domanda, risposta) da un flusso di chunk di testo."""
+    for block in _iter_blocks(chunks):
+        yield from _iter_block_qa(block, cache)
+
+
+def _decoded_chunks(binary_file, chunk_size=STREAM_CHUNK_SIZE, encoding='utf-8'):
+    """Legge e decodifica un file binario a chunk di chunk_size byte."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while True:
+        data = binary_file.read(chunk_size)
+        if not data:
+            break
+        yield decoder.decode(data)
+    yield decoder.decode(b'', final=True)
+
+
+def iter_qa_from_stream(binary_file, chunk_size=STREAM_CHUNK_SIZE, encoding='utf-8', cache=None):
+    """Estrae domande e risposte da un file binario, un blocco alla volta.
+
+    Il file viene letto e decodificato a chunk: ogni coppia viene prodotta
+    appena il suo blocco è completo, senza tenere in memoria l'intero
+    contenuto. Le coppie sono le stesse (e nello stesso ordine) di
+    extract_qa_from_markdown sul contenuto decodificato.
+
+    Args:
+        binary_file: Oggetto file aperto in modalità binaria (es. UploadedFile)
+        chunk_size: Numero di byte letti per volta
+        encoding: Codifica del contenuto
+        cache: Cache di rendering opzionale (es. render_cache.RenderCache)
+
+    Yields:
+        Tuple (domanda, risposta) con HTML compatibile con Anki
+    """
+    yield from _iter_qa_from_chunks(_decoded_chunks(binary_file, chunk_size, encoding), cache)
+
+
+def extract_qa_from_markdown(content, cache=None):
+    """Estrae domande e risposte dal contenuto markdown.
     
-    for block in blocks:
-        block = block.strip()
-        if not block:
-            continue
-        
-        # Pattern per trovare le domande
-        domanda_pattern = r'(?:(?:\*\*)?\s*Domanda\s*(?:\*\*)?\s*:\s*)\s*(?:\*\*)?\s*(.*?)(?=(?:(?:\*\*)?\s*(?:Risposta(?:\s+corretta)?|Domanda)\s*(?:\*\*)?\s*:\s*)|$)'
-        domande = re.finditer(domanda_pattern, block, re.DOTALL | re.IGNORECASE)
-        domande_list = [(m.start(), m.end(), m.group(1).strip()) for m in domande]
-        
-        # Pattern per trovare le risposte
-        risposta_pattern = r'(?:(?:\*\*)?\s*Risposta(?:\s+corretta)?\s*(?:\*\*)?\s*:\s*)\s*(?:\*\*)?\s*(.*?)(?=(?:(?:\*\*)?\s*(?:Domanda|Risposta(?:\s+corretta)?)\s*(?:\*\*)?\s*:\s*)|$)'
-        risposte = re.finditer(risposta_pattern, block, re.DOTALL | re.IGNORECASE)
-        risposte_list = [(m.start(), m.end(), m.group(1).strip()) for m in risposte]
+    Args:
+        content: Contenuto markdown già decodificato
+        cache: Cache di rendering opzionale (es. render_cache.RenderCache)
         
-        # Associa ogni domanda con la risposta che la segue
-        for i, (d_start, d_end, domanda) in enumerate(domande_list):
-            next_risposta = None
-            for r_start, r_end, risposta in risposte_list:
-                if r_start > d_start:
-                    next_domanda_exists = any(nd_start < r_start for nd_start, _, _ in domande_list[i+1:] if i+1 < len(domande_list))
-                    if not next_domanda_exists:
-                        next_risposta = risposta
-                        break
-            
-            if next_risposta:
-                # Pulisci asterischi
-                domanda = re.sub(r'^(\*\*)+\s*', '', domanda).strip()
-                domanda = re.sub(r'\s*(\*\*)+$', '', domanda).strip()
-                next_risposta = re.sub(r'^(\*\*)+\s*', '', next_risposta).strip()
-                next_risposta = re.sub(r'\s*(\*\*)+$', '', next_risposta).strip()
-                
-                # Applica trasformazioni
-                domanda_formattata = transform_math_formulas(domanda)
-                risposta_formattata = transform_math_formulas(next_risposta)
-                
-                # Escape HTML
-                domanda_formattata = escape_anki_html(domanda_formattata)
-                risposta_formattata = escape_anki_html(risposta_formattata)
-                
-                qa_dict[domanda_formattata] = risposta_formattata
-    
-    return qa_dict
\ No newline at end of file
+    Returns:
+        Dizionario domanda -> risposta; a parità di domanda vince l'ultima
+    """
+    return dict(_iter_qa_from_chunks((content,), cache))
+
+
+
+def _item_name(item):
+    """Nome del file di un elemento di extract_many."""
+    return item[0] if isinstance(item, tuple) else os.path.basename(item)
+
+
+def _item_chunks(item):
+    """Nome e chunk di testo di un elemento di extract_many.
+
+    Una stringa sola è un percorso; dentro una tupla (nome, sorgente) è
+    invece il contenuto già decodificato.
+    """
+    name = _item_name(item)
+    if isinstance(item, tuple):
+        source = item[1]
+        if isinstance(source, str):
+            return name, (source,)
+        if isinstance(source, bytes):
+            return name, _decoded_chunks(io.BytesIO(source))
+    else:
+        source = item
+
+    def read():
+        with open(source, 'rb') as f:
+            yield from _decoded_chunks(f)
+
+    return name, read()
+
+
+def _extract_file(item, cache=None, records=False):
+    """Estrae le coppie di un singolo file di extract_many.
+
+    Returns:
+        Tupla (nome_file, qa_dict_del_file) oppure, con records, (nome_file,
+        mappa sorgente di _extract_blocks) per extract_cards
+    """
+    name, chunks = _item_chunks(item)
+    if records:
+        return name, _extract_blocks(chunks, cache)
+    return name, dict(_iter_qa_from_chunks(chunks, cache))
+
+
+# Cache di rendering del processo worker corrente (vedi _init_worker)
+_worker_cache = None
+
+
+def _init_worker(cache_settings):
+    """Inizializza un worker di extract_many aprendo la cache su disco condivisa."""
+    global _worker_cache
+    if cache_settings is not None:
+        from render_cache import RenderCache
+        _worker_cache = RenderCache(**cache_settings)
+
+
+def _extract_file_in_worker(item, records=False):
+    """Estrae un file in un worker e restituisce anche le statistiche di cache prodotte."""
+    if _worker_cache is None:
+        return _extract_file(item, records=records), None
+
+    before = _worker_cache.stats()
+    result = _extract_file(item, _worker_cache, records)
+    _worker_cache.flush()
+    after = _worker_cache.stats()
+    return result, {name: after[name] - before[name] for name in _worker_cache.COUNTERS}
+
+
+def _extract_files(files, jobs, cache, records=False):
+    """Estrae i file con _extract_file, in parallelo se jobs > 1, nell'ordine di input."""
+    files = list(files)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(files))
+
+    if jobs <= 1:
+        return [_extract_file(item, cache, records) for item in files]
+
+    cache_settings = cache.settings() if cache is not None and cache.db_path else None
+    if cache_settings is not None:
+        # I worker devono vedere le card già scritte da questo processo
+        cache.flush()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(cache_settings,)) as pool:
+        results = []
+        for result, cache_stats in pool.map(_extract_file_in_worker, files, itertools.repeat(records)):
+            results.append(result)
+            if cache_stats:
+                cache.record_stats(cache_stats)
+    return results
+
+
+def extract_many(files, jobs=None, cache=None):
+    """Estrae domande e risposte da più file in parallelo.
+
+    I file vengono elaborati da un pool di processi, ma i risultati vengono
+    uniti nell'ordine di input: a parità di domanda vince il file che viene
+    dopo, esattamente come con un ciclo sequenziale.
+
+    Args:
+        files: Iterabile di file; ogni elemento è un percorso (il nome è il
+            basename) oppure una tupla (nome, sorgente) con sorgente bytes,
+            str già decodificata o percorso os.PathLike
+        jobs: Numero di processi; None usa tutti i core, 1 lavora nel processo
+            corrente
+        cache: Cache di rendering opzionale (render_cache.RenderCache). In
+            parallelo ogni worker apre lo stesso database su disco; una cache
+            solo in memoria viene usata soltanto in modalità sequenziale
+
+    Returns:
+        Tupla (qa_dict, qa_dict_per_file); i file senza coppie non compaiono
+        in qa_dict_per_file
+    """
+    qa_dict = {}
+    qa_dict_per_file = {}
+    for name, file_qa_dict in _extract_files(files, jobs, cache):
+        if file_qa_dict:
+            qa_dict_per_file[name] = file_qa_dict
+            qa_dict.update(file_qa_dict)
+    return qa_dict, qa_dict_per_file
+
+
+def extract_cards(files, jobs=None, cache=None, store=None):
+    """Come extract_many, ma raccoglie le card in un CardStore indicizzato.
+
+    Oltre ai campi renderizzati, ogni card conserva i campi markdown grezzi e
+    la sua posizione nel file (riga, offset, blocco e hash del blocco).
+
+    Un file che store conosce già, con la sua mappa sorgente, viene
+    rielaborato a blocchi nel processo corrente: solo i blocchi modificati
+    passano da riconoscimento e rendering, e le card dei blocchi invariati
+    restano le stesse (vedi CardStore.set_file). Gli altri file vengono
+    estratti per intero, in parallelo se jobs lo consente.
+
+    Args:
+        files: File da estrarre (vedi extract_many)
+        jobs: Numero di processi (vedi extract_many)
+        cache: Cache di rendering opzionale (vedi extract_many)
+        store: CardStore da aggiornare; i file estratti sostituiscono quelli
+            con lo stesso nome. Default: un CardStore nuovo
+
+    Returns:
+        Il CardStore con le card dei file, nell'ordine di input
+    """
+    if store is None:
+        store = CardStore()
+    files = list(files)
+    known = [store.file_blocks(_item_name(item)) is not None for item in files]
+    extracted = iter(_extract_files(
+        [item for item, is_known in zip(files, known) if not is_known], jobs, cache, records=True
+    ))
+    for item, is_known in zip(files, known):
+        if is_known:
+            name, chunks = _item_chunks(item)
+            blocks = _extract_blocks(chunks, cache, store.file_blocks(name))
+        else:
+            name, blocks = next(extracted)
+        store.set_file(name, blocks)
+    return store
+
+
+def file_fingerprint(data):
+    """Calcola l'impronta del contenuto di un file (bytes) per riconoscere i file invariati."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def extract_cards_incremental(files, fingerprints, store, jobs=None, cache=None):
+    """Aggiorna un'estrazione precedente rielaborando solo i file nuovi o modificati.
+
+    Le card dei file invariati mantengono identificativi e modifiche fatte
+    nell'anteprima; i file modificati vengono rielaborati solo nei blocchi
+    cambiati (vedi extract_cards), così anche le card dei loro blocchi
+    invariati restano com'erano, e i file non più presenti vengono rimossi.
+
+    Args:
+        files: Lista di tuple (nome, contenuto_bytes) nell'ordine di caricamento
+        fingerprints: Impronte dell'estrazione precedente (nome -> impronta)
+        store: CardStore dell'estrazione precedente, aggiornato sul posto
+        jobs: Numero di processi per i file da rielaborare (vedi extract_many)
+        cache: Cache di rendering opzionale (vedi extract_many)
+
+    Returns:
+        Tupla (fingerprints, reparsed) dove reparsed è la lista dei nomi dei
+        file effettivamente rielaborati
+    """
+    new_fingerprints = {name: file_fingerprint(data) for name, data in files}
+    changed = [
+        (name, data) for name, data in files
+        if fingerprints.get(name) != new_fingerprints[name]
+    ]
+    extract_cards(changed, jobs=jobs, cache=cache, store=store)
+    store.retain_files([name for name, _ in files])
+    return new_fingerprints, [name for name, _ in changed]
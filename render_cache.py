@@ -0,0 +1,208 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from qa_extractor import RENDER_PIPELINE_VERSION, render_field
+
+# Numero di scritture su disco dopo cui la transazione viene confermata
+_COMMIT_EVERY = 500
+
+
+def card_cache_key(domanda, risposta, version=RENDER_PIPELINE_VERSION):
+    """Calcola la chiave di cache di una card dal testo grezzo e dalla versione della pipeline."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{version}\0'.encode('utf-8'))
+    digest.update(domanda.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(risposta.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """Cache delle card renderizzate, indicizzata per hash del contenuto grezzo.
+
+    Un primo livello LRU in memoria, limitato a max_entries card, è affiancato
+    da un livello SQLite opzionale (db_path) limitato a max_db_bytes byte di
+    HTML: quando il limite viene superato si eliminano le card usate meno di
+    recente. Le card trovate in cache saltano transform_math_formulas ed
+    escape_anki_html.
+
+    L'istanza è thread-safe, così può essere condivisa tra le sessioni di
+    Streamlit; più processi possono aprire lo stesso database su disco. Le
+    scritture avvengono in transazioni BEGIN IMMEDIATE: all'inizio di ognuna
+    occupazione e orologio LRU vengono riletti dal database, così ogni
+    processo vede quanto scritto dagli altri prima di decidere le evizioni.
+    """
+
+    COUNTERS = ('memory_hits', 'disk_hits', 'misses', 'memory_evictions', 'disk_evictions')
+
+    def __init__(self, max_entries=10000, db_path=None, max_db_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.max_db_bytes = max_db_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(self.COUNTERS, 0)
+
+        self._db = None
+        self._pending_writes = 0
+        # Occupazione e orologio LRU del database, validi solo dentro una transazione di scrittura
+        self._db_bytes = 0
+        self._clock = 0
+        if db_path is not None:
+            self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            # WAL permette letture concorrenti mentre un altro processo scrive
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS render_cache ('
+                ' key TEXT PRIMARY KEY,'
+                ' question TEXT NOT NULL,'
+                ' answer TEXT NOT NULL,'
+                ' size INTEGER NOT NULL,'
+                ' last_used INTEGER NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS render_cache_last_used ON render_cache (last_used)')
+            self._db.commit()
+
+    def render_card(self, domanda, risposta):
+        """Restituisce la coppia (domanda, risposta) renderizzata, usando la cache se possibile.
+
+        Args:
+            domanda: Testo grezzo della domanda, già ripulito dagli asterischi
+            risposta: Testo grezzo della risposta, già ripulito dagli asterischi
+
+        Returns:
+            Tupla (domanda_html, risposta_html)
+        """
+        key = card_cache_key(domanda, risposta)
+
+        with self._lock:
+            rendered = self._memory.get(key)
+            if rendered is not None:
+                self._memory.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return rendered
+
+            if self._db is not None:
+                rendered = self._load(key)
+                if rendered is not None:
+                    self._counters['disk_hits'] += 1
+                    self._remember(key, rendered)
+                    return rendered
+
+            self._counters['misses'] += 1
+
+        # Il rendering avviene fuori dal lock: due miss concorrenti sulla
+        # stessa card producono lo stesso risultato
+        rendered = (render_field(domanda), render_field(risposta))
+
+        with self._lock:
+            self._remember(key, rendered)
+            if self._db is not None:
+                self._store(key, rendered)
+        return rendered
+
+    def stats(self):
+        """Restituisce i contatori di hit, miss ed evizioni e l'occupazione dei due livelli."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['hits'] = stats['memory_hits'] + stats['disk_hits']
+            stats['memory_entries'] = len(self._memory)
+            stats['disk_bytes'] = self._disk_bytes() if self._db is not None else 0
+        return stats
+
+    def settings(self):
+        """Restituisce i parametri per aprire una cache equivalente in un altro processo."""
+        return {'max_entries': self.max_entries, 'db_path': self.db_path, 'max_db_bytes': self.max_db_bytes}
+
+    def record_stats(self, delta):
+        """Somma ai contatori quelli prodotti da una cache equivalente in un altro processo."""
+        with self._lock:
+            for name in self.COUNTERS:
+                self._counters[name] += delta.get(name, 0)
+
+    def flush(self):
+        """Conferma su disco le scritture in sospeso."""
+        with self._lock:
+            if self._db is not None and self._pending_writes:
+                self._db.commit()
+                self._pending_writes = 0
+
+    def close(self):
+        """Conferma le scritture in sospeso e chiude il database."""
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _remember(self, key, rendered):
+        """Inserisce una card nel livello in memoria, eliminando la meno recente se pieno."""
+        self._memory[key] = rendered
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._counters['memory_evictions'] += 1
+
+    def _disk_bytes(self):
+        """Occupazione del database, comprese le scritture degli altri processi."""
+        return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM render_cache').fetchone()[0]
+
+    def _begin(self):
+        """Apre la transazione di scrittura, se non è già aperta, e rilegge lo stato del database.
+
+        Dentro la transazione nessun altro processo può scrivere, quindi i
+        valori riletti restano esatti fino al commit.
+        """
+        if self._db.in_transaction:
+            return
+        self._db.execute('BEGIN IMMEDIATE')
+        self._db_bytes, self._clock = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0), COALESCE(MAX(last_used), 0) FROM render_cache'
+        ).fetchone()
+
+    def _load(self, key):
+        row = self._db.execute(
+            'SELECT question, answer FROM render_cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self._begin()
+        self._clock += 1
+        self._db.execute('UPDATE render_cache SET last_used = ? WHERE key = ?', (self._clock, key))
+        self._written()
+        return row
+
+    def _store(self, key, rendered):
+        question, answer = rendered
+        size = len(question.encode('utf-8')) + len(answer.encode('utf-8'))
+        self._begin()
+        self._clock += 1
+        previous = self._db.execute('SELECT size FROM render_cache WHERE key = ?', (key,)).fetchone()
+        self._db.execute(
+            'INSERT OR REPLACE INTO render_cache (key, question, answer, size, last_used) VALUES (?, ?, ?, ?, ?)',
+            (key, question, answer, size, self._clock)
+        )
+        self._db_bytes += size - (previous[0] if previous else 0)
+        if self._db_bytes > self.max_db_bytes:
+            self._evict_disk()
+        self._written()
+
+    def _evict_disk(self):
+        """Elimina le card usate meno di recente finché il database torna al 90% del limite."""
+        target = self.max_db_bytes * 0.9
+        self._db_bytes = self._disk_bytes()
+        victims = []
+        for key, size in self._db.execute('SELECT key, size FROM render_cache ORDER BY last_used'):
+            if self._db_bytes <= target:
+                break
+            victims.append((key,))
+            self._db_bytes -= size
+        self._db.executemany('DELETE FROM render_cache WHERE key = ?', victims)
+        self._counters['disk_evictions'] += len(victims)
+
+    def _written(self):
+        self._pending_writes += 1
+        if self._pending_writes >= _COMMIT_EVERY:
+            self._db.commit()
+            self._pending_writes = 0
@@ -0,0 +1,190 @@
+"""Rielaborazione a blocchi: deve dare sempre lo stesso risultato di un'estrazione completa.
+
+Uso:
+    python -m pytest tests
+"""
+import os
+import random
+import re
+import sqlite3
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import qa_extractor
+from benchmarks.corpus import generate_markdown
+from project_store import PROJECT_FORMAT, ProjectStore
+from qa_extractor import _BLOCK_SEPARATOR_RE, extract_cards, extract_cards_incremental
+
+SEPARATOR = '\n---\n'
+_MARKER_RE = re.compile(r'(\*\*)?\s*Domanda')
+
+
+@pytest.fixture
+def rendered_blocks(monkeypatch):
+    """Conta i blocchi che passano da riconoscimento e rendering."""
+    calls = []
+    block_cards = qa_extractor._block_cards
+
+    def counting(block, cache=None):
+        calls.append(block)
+        return block_cards(block, cache)
+
+    monkeypatch.setattr(qa_extractor, '_block_cards', counting)
+    return calls
+
+
+def snapshot(store):
+    return [
+        (card.file, card.line, card.offset, card.block, card.block_hash,
+         card.raw_question, card.raw_answer, card.question, card.answer)
+        for card in store
+    ]
+
+
+def assert_same_as_full(store, files):
+    fresh = extract_cards(files, jobs=1)
+    assert store.files() == fresh.files()
+    assert snapshot(store) == snapshot(fresh)
+    assert store.qa_dict_per_file() == fresh.qa_dict_per_file()
+    assert store.qa_dict() == fresh.qa_dict()
+    texts = dict(files)
+    for card in store:
+        data = texts[card.file].encode('utf-8')
+        assert _MARKER_RE.match(data[card.offset:card.offset + 20].decode('utf-8', 'ignore'))
+        assert data.count(b'\n', 0, card.offset) + 1 == card.line
+
+
+def random_edit(rng, blocks, step):
+    """Applica a blocks una modifica casuale e restituisce il numero massimo di blocchi da rielaborare."""
+    i = rng.randrange(len(blocks))
+    kind = rng.choice(('edit', 'insert', 'delete', 'duplicate', 'repeat_question', 'whitespace', 'move'))
+    if kind == 'edit':
+        blocks[i] = blocks[i].replace('Risposta', f'Risposta:\nriga {step} è', 1)
+    elif kind == 'insert':
+        blocks.insert(i, f'Domanda: nuova {step}?\nRisposta: sì\n\nDomanda: altra {step}?\nRisposta: ok')
+    elif kind == 'delete' and len(blocks) > 1:
+        del blocks[i]
+        return 0
+    elif kind == 'duplicate':
+        blocks.insert(rng.randrange(len(blocks)), blocks[i])
+        return 0
+    elif kind == 'repeat_question':
+        # Domanda ripetuta in blocchi diversi dello stesso file: vince l'ultima risposta
+        blocks.insert(rng.randrange(len(blocks)), f'Domanda: ripetuta?\nRisposta: {step}')
+    elif kind == 'whitespace':
+        blocks[i] = '\n\n  ' + blocks[i]
+    elif kind == 'move':
+        blocks.insert(rng.randrange(len(blocks)), blocks.pop(i))
+        return 0
+    return 1
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_block_reparse_matches_full_extraction(seed, rendered_blocks):
+    rng = random.Random(seed)
+    blocks = _BLOCK_SEPARATOR_RE.split(generate_markdown(60, seed=seed))
+    other = ('b.md', generate_markdown(10, seed=seed + 100))
+    store = extract_cards([('a.md', SEPARATOR.join(blocks)), other], jobs=1)
+
+    for step in range(10):
+        limit = random_edit(rng, blocks, step)
+        files = [('a.md', SEPARATOR.join(blocks)), other]
+        del rendered_blocks[:]
+        extract_cards(files[:1], jobs=1, store=store)
+        assert len(rendered_blocks) <= limit
+        assert_same_as_full(store, files)
+
+
+def test_unchanged_blocks_keep_cards_and_edits():
+    blocks = _BLOCK_SEPARATOR_RE.split(generate_markdown(30, seed=1))
+    store = extract_cards([('a.md', SEPARATOR.join(blocks))], jobs=1)
+    first, middle, last = store[0], store[len(store) // 2], store[len(store) - 1]
+    store.update(first.id, answer='modificata')
+
+    blocks[-1] += '\n\nDomanda: aggiunta?\nRisposta: sì'
+    extract_cards([('a.md', SEPARATOR.join(blocks))], jobs=1, store=store)
+
+    assert store[0] is first and first.answer == 'modificata'
+    assert store.get(middle.id) is middle
+    # Il blocco modificato produce card nuove
+    assert last.id not in {card.id for card in store}
+    assert store[len(store) - 1].raw_question == 'aggiunta?'
+
+
+def test_reopened_project_reparses_only_changed_blocks(tmp_path, rendered_blocks):
+    path = str(tmp_path / 'progetto.sqlite')
+    blocks = _BLOCK_SEPARATOR_RE.split(generate_markdown(200, seed=2))
+    files = [('a.md', SEPARATOR.join(blocks).encode()), ('b.md', generate_markdown(20, seed=3).encode())]
+
+    project = ProjectStore(path)
+    project.save_extraction(*extract_cards_incremental(files, project.fingerprints, project.cards, jobs=1))
+    edited = project.update_card(project.cards[5].id, answer='a mano')
+    project.close()
+
+    project = ProjectStore(path)
+    blocks[-2] += '\n\nDomanda: aggiunta?\nRisposta: sì'
+    files[0] = ('a.md', SEPARATOR.join(blocks).encode())
+    del rendered_blocks[:]
+    fingerprints, reparsed = extract_cards_incremental(files, project.fingerprints, project.cards, jobs=1)
+    project.save_extraction(fingerprints, reparsed)
+    assert reparsed == ['a.md'] and len(rendered_blocks) == 1
+    assert project.cards.get(edited.id).answer == 'a mano'
+    saved = snapshot(project.cards), [card.id for card in project.cards]
+    project.close()
+
+    project = ProjectStore(path)
+    assert (snapshot(project.cards), [card.id for card in project.cards]) == saved
+    fresh = extract_cards([(name, data.decode()) for name, data in files], jobs=1)
+    fresh.update(fresh[5].id, answer='a mano')
+    assert project.cards.qa_dict_per_file() == fresh.qa_dict_per_file()
+    assert project.search('aggiunta') and project.stats()['cards'] == len(fresh)
+    project.close()
+
+
+# Schema del formato 1, prima della mappa sorgente
+_FORMAT_1_SCHEMA = (
+    'CREATE TABLE files (name TEXT PRIMARY KEY, position INTEGER NOT NULL, fingerprint TEXT NOT NULL)',
+    'CREATE TABLE cards (id INTEGER PRIMARY KEY, file TEXT NOT NULL, position INTEGER NOT NULL,'
+    ' line INTEGER NOT NULL, raw_question TEXT NOT NULL, raw_answer TEXT NOT NULL,'
+    ' question TEXT NOT NULL, answer TEXT NOT NULL)',
+    'CREATE INDEX cards_file ON cards (file, position, line)',
+    'CREATE TABLE edits (seq INTEGER PRIMARY KEY, card_id INTEGER NOT NULL, time REAL NOT NULL,'
+    ' old_question TEXT NOT NULL, old_answer TEXT NOT NULL, new_question TEXT NOT NULL, new_answer TEXT NOT NULL)',
+    'CREATE INDEX edits_card ON edits (card_id)',
+)
+
+
+def test_format_1_project_is_migrated(tmp_path):
+    path = str(tmp_path / 'vecchio.sqlite')
+    data = b'Domanda: prima?\nRisposta: uno\n---\nDomanda: seconda?\nRisposta: due'
+    db = sqlite3.connect(path)
+    with db:
+        for statement in _FORMAT_1_SCHEMA:
+            db.execute(statement)
+        db.execute("INSERT INTO files VALUES ('a.md', 0, ?)", (qa_extractor.file_fingerprint(data),))
+        db.executemany('INSERT INTO cards VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+            (1, 'a.md', 0, 1, 'prima?', 'uno', 'prima?', 'uno'),
+            (2, 'a.md', 1, 4, 'seconda?', 'due', 'seconda?', 'modificata'),
+        ])
+        db.execute('PRAGMA user_version = 1')
+    db.close()
+
+    project = ProjectStore(path)
+    assert project._db.execute('PRAGMA user_version').fetchone()[0] == PROJECT_FORMAT
+    assert [(card.id, card.answer) for card in project.cards] == [(1, 'uno'), (2, 'modificata')]
+    assert project.cards.file_blocks('a.md') is None
+
+    # Senza mappa sorgente il file viene rielaborato per intero, e la mappa viene salvata
+    files = [('a.md', data + b'\n---\nDomanda: terza?\nRisposta: tre')]
+    project.save_extraction(*extract_cards_incremental(files, project.fingerprints, project.cards, jobs=1))
+    project.close()
+
+    project = ProjectStore(path)
+    assert project.cards.file_blocks('a.md') is not None
+    assert project.cards.qa_dict_per_file() == extract_cards(files, jobs=1).qa_dict_per_file()
+    assert project.search('terza')
+    project.close()